@@ -1,21 +1,52 @@
-import spacy
 import pandas as pd
 import re
+import sys
+from functools import lru_cache
+from schemaregistry import get_alias_index, build_alias_index
+from nlpfallback import resolve_chart_type
+from datasetloader import load_dataset, schema_for
+from filtercompiler import apply_filter
+from datasetindex import index_dataset
+from topk import top_k, top_k_per_group
+from aggcubes import AggregateCubes, group_aggregate
+from chartspecs import CHART_SPECS, ChartSpecError, validate_chart, render_chart
+from streamingest import LiveViewership
 import matplotlib.pyplot as plt
-import seaborn as sns
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")
+DATA_PATH = 'converted.csv'
 
-# Read data from CSV file
-df = pd.read_csv('converted.csv')
+@lru_cache(maxsize=None)
+def load_data():
+    # Read data from CSV file, only once a request actually needs the rows,
+    # and index it for the range and equality filters
+    return index_dataset(load_dataset(DATA_PATH))
 
-# Function to generate column aliases
-import re
+def numeric_frame(df):
+    # Convert relevant columns to numeric (if they are not already numeric)
+    numeric_columns = ['bytesFromClient','bytesFromServer','lostBytesClient','transationDuration','lostBytesServer','srttMsClient','srttMsServer','PublicSourcePort','PublicDestinationPort']
+    # (into a new frame, df can be the cached dataset itself when no filter applied)
+    df = df.assign(**{column: pd.to_numeric(df[column], errors='coerce') for column in numeric_columns})
+    
+    # Handle any remaining non-numeric values or NaNs depending on your analysis needs
+    return df.dropna(subset=numeric_columns)
+
+@lru_cache(maxsize=None)
+def load_cubes():
+    # Group-by aggregates of the cleaned dataset, answer the pie and group by
+    # charts when the request only filters on low cardinality columns
+    return AggregateCubes(numeric_frame(load_data()))
+
+def cubes_for(chart_type, group_by, top_x):
+    # Only the charts that aggregate the dataset use the cubes, and not
+    # after a top-N cut of the rows
+    if top_x or not (group_by or CHART_SPECS[chart_type].aggregation):
+        return None
+    return load_cubes()
 
-def generate_column_aliases(df):
+# Function to generate column aliases
+def generate_column_aliases(columns):
     column_aliases = {}
-    for col in df.columns:
+    for col in columns:
         col_variations = [
             col,
             col.lower(),
@@ -32,32 +63,28 @@ def generate_column_aliases(df):
             column_aliases[variation] = col
     return column_aliases
 
-# Example usage:
-# Assuming df is your DataFrame with columns as defined earlier
-
-# Generate dynamic column aliases
-column_aliases = generate_column_aliases(df)
+def column_alias_index():
+    # Built from the CSV header only and cached on disk per schema
+    return get_alias_index(DATA_PATH, generate_column_aliases)
 
 # Print out the generated aliases for verification
-#for alias, original_col in column_aliases.items():
+#for alias, original_col in column_alias_index().aliases.items():
    # print(f"Alias: {alias} -> Original Column: {original_col}")
 
 
-def parse_request(request, df, column_aliases):
+def parse_request(request, alias_index):
     entities = {'chart_type': 'table', 'columns': [], 'conditions': [], 'group_by': None, 'order_by': None, 'top_x': None}
     request_lower = request.lower()
 
     # Extract chart type
     chart_types = ['pie', 'bar', 'histogram', 'line', 'area', 'scatter', 'box', 'heatmap', 'violin', 'bubble', 'table']
-    chart_type_pattern = r'\b(' + '|'.join(chart_types) + r')\b'
-    chart_type_match = re.search(chart_type_pattern, request_lower)
-    if chart_type_match:
-        entities['chart_type'] = chart_type_match.group(1)
+    # Regex first, spaCy is only loaded if that finds nothing
+    chart_type = resolve_chart_type(request_lower, chart_types)
+    if chart_type:
+        entities['chart_type'] = chart_type
 
     # Extract columns
-    for alias, actual_col in column_aliases.items():
-        if alias in request_lower and actual_col not in entities['columns']:
-            entities['columns'].append(actual_col)
+    entities['columns'] = alias_index.columns_in(request_lower)
 
     # Extract conditions
     condition_patterns = [
@@ -74,11 +101,7 @@ def parse_request(request, df, column_aliases):
                     operator_text = match[i + 1].strip().lower()
                     value = int(match[i + 2].strip())
 
-                    condition_col = None
-                    for alias, actual_col in column_aliases.items():
-                        if alias == condition_col_text:
-                            condition_col = actual_col
-                            break
+                    condition_col = alias_index.lookup(condition_col_text)
 
                     if condition_col:
                         if operator_text in ['equals', 'equal']:
@@ -94,11 +117,7 @@ def parse_request(request, df, column_aliases):
                 operator_text = match[1].strip().lower()
                 value = int(match[2].strip())
 
-                condition_col = None
-                for alias, actual_col in column_aliases.items():
-                    if alias == condition_col_text:
-                        condition_col = actual_col
-                        break
+                condition_col = alias_index.lookup(condition_col_text)
 
                 if condition_col:
                     if operator_text in ['equals', 'equal']:
@@ -113,19 +132,13 @@ def parse_request(request, df, column_aliases):
     group_by_match = re.search(r'group by (\b\w+\b)', request_lower)
     if group_by_match:
         group_by_col_text = group_by_match.group(1).strip().lower()
-        for alias, actual_col in column_aliases.items():
-            if alias == group_by_col_text:
-                entities['group_by'] = actual_col
-                break
+        entities['group_by'] = alias_index.lookup(group_by_col_text)
 
     # Extract order by
     order_by_match = re.search(r'order by (\b\w+\b)', request_lower)
     if order_by_match:
         order_by_col_text = order_by_match.group(1).strip().lower()
-        for alias, actual_col in column_aliases.items():
-            if alias == order_by_col_text:
-                entities['order_by'] = actual_col
-                break
+        entities['order_by'] = alias_index.lookup(order_by_col_text)
 
     # Extract top X
     top_x_match = re.search(r'top (\d+) based on (\b\w+\b)', request_lower)
@@ -151,146 +164,108 @@ def extract_details(structured_query):
     top_x = structured_query['top_x']
     return chart_type, columns, conditions, group_by, order_by, top_x
 
-def filter_data(df, conditions, top_x=None):
-    # Apply conditions
-    if conditions:
-        for condition in conditions:
-            filter_col = condition['column']
-            operator = condition['operator']
-            value = condition['value']
-            if operator in ['greater', 'more', 'older', 'above']:
-                df = df[df[filter_col] > value]
-            elif operator in ['less', 'below', 'younger']:
-                df = df[df[filter_col] < value]
-            elif operator in ['equal', 'equals']:
-                df = df[df[filter_col] == value]
+def filter_data(df, conditions, top_x=None, group_by=None):
+    # Apply conditions, all in one pass
+    df = apply_filter(df, conditions)
     
-    # Apply top X if specified
+    # Apply top X if specified, within each group for a group by request
     if top_x:
         num_rows, column = top_x
-        actual_column = column_aliases.get(column, column)
+        actual_column = column_alias_index().lookup(column) or column
         if actual_column in df.columns:
-            df = df.sort_values(by=actual_column, ascending=False).head(num_rows)
+            if group_by in df.columns:
+                df = top_k_per_group(df, group_by, actual_column, num_rows)
+            else:
+                df = top_k(df, actual_column, num_rows)
     
     return df
 
-def generate_chart(df, chart_type, columns, group_by=None, order_by=None, save_path=None):
-    if chart_type == 'table':
-        columns_to_display = columns
-        df_to_display = df[columns_to_display]
-        fig, ax = plt.subplots(figsize=(10, 4))  # Create a new figure with a specified size
-        ax.axis('tight')
-        ax.axis('off')
-        table = ax.table(cellText=df_to_display.values, colLabels=df_to_display.columns, cellLoc='center', loc='center')
-        table.auto_set_font_size(False)
-        table.set_fontsize(10)
-        table.scale(1.2, 1.2)  # Adjust the scale to fit the table better
-
-        if save_path:
-            plt.savefig(save_path, format='png')
-            print(f"Chart saved successfully as {save_path}")
-
-        plt.show()
-        return
-    
-    plt.figure(figsize=(10, 6))
-    # Convert relevant columns to numeric (if they are not already numeric)
-    numeric_columns = ['bytesFromClient','bytesFromServer','lostBytesClient','transationDuration','lostBytesServer','srttMsClient','srttMsServer','PublicSourcePort','PublicDestinationPort']
-    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
-    
-    # Handle any remaining non-numeric values or NaNs depending on your analysis needs
-    df.dropna(subset=numeric_columns, inplace=True)
-    
-    # Perform group by and mean calculation
-    if group_by:
-        try:
-            group_by_cols = [group_by] if isinstance(group_by, str) else group_by
-            df = df.groupby(group_by_cols).mean(numeric_only=True).reset_index()
-        except TypeError as e:
-            print(f"Error occurred during groupby and mean calculation: {e}")
-            return
-    
-    if chart_type in ['line', 'scatter', 'area', 'bubble'] and len(columns) < 2:
-        print(f"Chart type '{chart_type}' requires at least two columns.")
+def generate_chart(df, chart_type, columns, group_by=None, order_by=None, save_path=None, cubes=None, conditions=None):
+    # cubes (from load_cubes) can only stand in for df when df is the dataset
+    # filtered by conditions and nothing else
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
+        print(f"Chart type '{chart_type}' is not supported.")
         return
-    if chart_type in ['bubble'] and len(columns) < 3:
-        print(f"Bubble chart requires at least three columns.")
+    if chart_type != 'table':
+        df = numeric_frame(df)
+
+        # Perform group by and mean calculation
+        if group_by:
+            try:
+                group_by_cols = [group_by] if isinstance(group_by, str) else group_by
+                df = group_aggregate(df, group_by_cols, 'mean', None, cubes, conditions).reset_index()
+                cubes = None  # df is aggregated from here on
+            except TypeError as e:
+                print(f"Error occurred during groupby and mean calculation: {e}")
+                return
+
+        if order_by:
+            df = df.sort_values(by=order_by)
+
+    fig = plt.figure(figsize=spec.figsize)
+    try:
+        render_chart(fig, chart_type, df, columns, cubes, conditions)
+    except ChartSpecError as e:
+        print(f"Cannot draw this chart: {e}")
+        plt.close(fig)
         return
-    
-    if order_by:
-        df = df.sort_values(by=order_by)
-
-    if chart_type == 'bar':
-        df.plot(kind='bar', x=columns[0], y=columns[1])
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} by {columns[0].capitalize()}')
-    elif chart_type == 'histogram':
-        df[columns[0]].plot(kind='hist', bins=20)
-        plt.xlabel(columns[0].capitalize())
-        plt.title(f'{columns[0].capitalize()} Histogram')
-    elif chart_type == 'line':
-        for col in columns[1:]:
-            plt.plot(df[columns[0]], df[col], label=col.capitalize())
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel('Values')
-        plt.title(f'{columns[0].capitalize()} Line Plot')
-        plt.legend()
-    elif chart_type == 'pie':
-        data = df[columns[0]].value_counts()
-        plt.pie(data, labels=data.index, autopct='%1.1f%%')
-        plt.title(f'{columns[0].capitalize()} Distribution')
-    elif chart_type == 'scatter':
-        plt.scatter(df[columns[0]], df[columns[1]])
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()}')
-    elif chart_type == 'box':
-        sns.boxplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} by {columns[0].capitalize()}')
-    elif chart_type == 'heatmap':
-        sns.heatmap(df.pivot_table(index=columns[0], columns=columns[1], aggfunc='size'))
-        plt.xlabel(columns[1].capitalize())
-        plt.ylabel(columns[0].capitalize())
-        plt.title(f'{columns[0].capitalize()} vs {columns[1].capitalize()} Heatmap')
-    elif chart_type == 'violin':
-        sns.violinplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} by {columns[0].capitalize()}')
-    elif chart_type == 'area':
-        plt.fill_between(df[columns[0]], df[columns[1]], alpha=0.5)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()}')
-    elif chart_type == 'bubble':
-        plt.scatter(df[columns[0]], df[columns[1]], s=df[columns[2]]*100, alpha=0.5)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()}')
-    
+
     if save_path:
         plt.savefig(save_path, format='png')
         print(f"Chart saved successfully as {save_path}")
-    
+
     plt.show()
 
-# User request
-request = 'pie chart on devicetype '
+def follow_stream(path):
+    # Streaming mode: answers requests typed on stdin from running aggregates
+    # of the events appended to path, caught up before each answer
+    live = LiveViewership(path)
+    alias_index = build_alias_index(live.dimensions + live.measures, generate_column_aliases)
+    while True:
+        request = input("Enter your request (or 'exit' to quit): ").strip()
+        if request.lower() == 'exit':
+            break
+        print(f"{live.poll()} new events, {live.rows} in total")
+        chart_type, columns, conditions, group_by, order_by, top_x = extract_details(parse_request(request, alias_index))
+        if top_x:
+            top_x = (top_x[0], alias_index.lookup(top_x[1]) or top_x[1])
+        try:
+            frame, chart_columns = live.chart_frame(chart_type, columns, conditions, group_by, order_by, top_x)
+        except ChartSpecError as e:
+            print(f"Cannot draw this chart: {e}")
+            continue
+        fig = plt.figure(figsize=CHART_SPECS[chart_type].figsize)
+        render_chart(fig, chart_type, frame, chart_columns)
+        plt.show()
+
+if __name__ == '__main__':
+    # python Streaming_analysis.py --follow events.jsonl for the streaming mode
+    if len(sys.argv) > 2 and sys.argv[1] == '--follow':
+        follow_stream(sys.argv[2])
+        sys.exit()
+
+    # User request
+    request = 'pie chart on devicetype '
 
-# Parse the user request
-parsed_request = parse_request(request, df, column_aliases)
+    # Parse the user request
+    parsed_request = parse_request(request, column_alias_index())
 
-# Extract details
-chart_type, columns, conditions, group_by, order_by, top_x = extract_details(parsed_request)
+    # Extract details
+    chart_type, columns, conditions, group_by, order_by, top_x = extract_details(parsed_request)
 
-# Filter data based on conditions
-filtered_data = filter_data(df, conditions, top_x)
+    try:
+        # Nothing is loaded for a chart the columns cannot give
+        validate_chart(chart_type, columns, schema_for(DATA_PATH))
+    except ChartSpecError as e:
+        print(f"Cannot draw this chart: {e}")
+    else:
+        # Filter data based on conditions
+        filtered_data = filter_data(load_data(), conditions, top_x, group_by)
 
-# Corrected save path
-save_path = r'C:\Users\Maissa\Desktop\savedcharts\table_chart.png'
+        # Corrected save path
+        save_path = r'C:\Users\Maissa\Desktop\savedcharts\table_chart.png'
 
-# Generate the chart
-generate_chart(filtered_data, chart_type, columns, group_by, order_by, save_path)
+        # Generate the chart
+        generate_chart(filtered_data, chart_type, columns, group_by, order_by, save_path,
+                       cubes=cubes_for(chart_type, group_by, top_x), conditions=conditions)
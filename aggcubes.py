@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+from filtercompiler import filter_mask
+
+# Materialized aggregates for the group-by charts. AggregateCubes groups the
+# dataset once, when it is loaded, by every low cardinality dimension and by
+# every pair of them, keeping count/sum/sum of squares/min/max of each
+# numeric measure plus the row count per group. A pie or bar request grouped
+# by one dimension, with filters on at most one more dimension, is then
+# answered by filtering and re-aggregating a cube of a few hundred rows
+# instead of grouping the whole frame. Anything else (filters on other
+# columns, three dimensions, top N cuts) falls back to a groupby on the
+# filtered frame.
+
+MAX_DIMENSION_CARDINALITY = 64
+# Pairs whose cube could have more groups than this are not materialized
+MAX_CUBE_GROUPS = 10000
+
+def is_dimension(series, max_cardinality):
+    if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_float_dtype(series.dtype):
+        return False
+    return series.nunique() <= max_cardinality
+
+def is_measure(series):
+    return pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+class Cube:
+    # One grouping: keys holds a row per group (the dimension values), every
+    # statistic is a (groups, measures) array in the same row order
+    def __init__(self, df, values, shifts, dimensions):
+        grouped = values.groupby([df[dimension] for dimension in dimensions], observed=True)
+        sizes = grouped.size()
+        self.rows = sizes.to_numpy()
+        self.keys = sizes.index.to_frame(index=False)
+        self.count = grouped.count().to_numpy(dtype=np.float64)
+        self.sum = grouped.sum().to_numpy(dtype=np.float64)
+        self.min = grouped.min().to_numpy(dtype=np.float64)
+        self.max = grouped.max().to_numpy(dtype=np.float64)
+        # Squares are taken around the dataset mean, which keeps the variance
+        # from cancelling out when it is small next to the values
+        self.sumsq = ((values - shifts) ** 2).groupby([df[dimension] for dimension in dimensions], observed=True).sum().to_numpy()
+
+    def merge(self, other):
+        # Folds in a cube of the same dimensions built from more rows, as if
+        # this one had been built from both sets of rows
+        keys = pd.concat([self.keys, other.keys], ignore_index=True)
+        codes = keys.groupby(list(keys.columns), observed=True, sort=False).ngroup().to_numpy()
+        first = np.unique(codes, return_index=True)[1]
+        self.keys = keys.iloc[first].reset_index(drop=True).astype('category')
+        def fold(a, b, ufunc, initial):
+            stacked = np.concatenate([a, b])
+            out = np.full((len(first),) + stacked.shape[1:], initial, dtype=stacked.dtype)
+            ufunc.at(out, codes, stacked)
+            return out
+        self.rows = fold(self.rows, other.rows, np.add, 0)
+        self.count = fold(self.count, other.count, np.add, 0)
+        self.sum = fold(self.sum, other.sum, np.add, 0)
+        self.min = fold(self.min, other.min, np.fmin, np.nan)
+        self.max = fold(self.max, other.max, np.fmax, np.nan)
+        self.sumsq = fold(self.sumsq, other.sumsq, np.add, 0)
+
+class AggregateCubes:
+    def __init__(self, df, dimensions=None, measures=None, max_cardinality=MAX_DIMENSION_CARDINALITY):
+        if dimensions is None:
+            dimensions = [column for column in df.columns if is_dimension(df[column], max_cardinality)]
+        if measures is None:
+            measures = [column for column in df.columns if is_measure(df[column])]
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.integer_measures = {measure for measure in self.measures if pd.api.types.is_integer_dtype(df[measure].dtype)}
+        self.cubes = {}  # sorted dimension tuple -> Cube
+
+        values = df[self.measures].astype(np.float64)
+        self.shifts = values.mean().fillna(0)
+        cardinality = {dimension: df[dimension].nunique() for dimension in self.dimensions}
+        for i, first in enumerate(self.dimensions):
+            self.cubes[(first,)] = Cube(df, values, self.shifts, [first])
+            for second in self.dimensions[i + 1:]:
+                if cardinality[first] * cardinality[second] <= MAX_CUBE_GROUPS:
+                    self.cubes[(first, second)] = Cube(df, values, self.shifts, [first, second])
+
+    def add(self, df):
+        # Folds more rows of the dataset into every cube, for a dataset that
+        # keeps growing (see streamingest). The squares stay shifted by the
+        # mean of the first rows, any fixed shift gives the same variance
+        if len(df) == 0:
+            return
+        values = df[self.measures].astype(np.float64)
+        for key, cube in self.cubes.items():
+            cube.merge(Cube(df, values, self.shifts, list(key)))
+
+    def cube_for(self, dimensions):
+        if any(dimension not in self.dimensions for dimension in dimensions):
+            return None
+        key = tuple(sorted(set(dimensions), key=self.dimensions.index))
+        return self.cubes.get(key)
+
+    def aggregate(self, group_by, measures, how, conditions=None, fold_case=False):
+        # groupby(group_by)[measures].<how>() of the filtered dataset, or None
+        # if no cube covers the grouping plus the filtered columns
+        filtered_columns = [condition['column'] for condition in conditions or []]
+        cube = self.cube_for(list(group_by) + filtered_columns)
+        if cube is None or how not in ('size', 'count', 'sum', 'mean', 'min', 'max', 'var', 'std'):
+            return None
+        if any(measure not in self.measures or measure in group_by for measure in measures):
+            return None
+        selected = np.ones(len(cube.keys), dtype=bool)
+        if conditions:
+            # The conditions only refer to dimensions, so they filter the keys
+            selected = filter_mask(cube.keys, conditions, fold_case)
+        grouper = cube.keys[selected].groupby(list(group_by), observed=True, sort=True)
+        codes = grouper.ngroup().to_numpy()
+        index = grouper.size().index
+        groups = len(index)
+
+        rows = np.bincount(codes, weights=cube.rows[selected], minlength=groups)
+        if how == 'size':
+            return pd.Series(rows.astype(np.int64), index=index)
+
+        columns = [self.measures.index(measure) for measure in measures]
+        def combine(stat, ufunc, initial):
+            out = np.full((groups, len(columns)), initial, dtype=np.float64)
+            ufunc.at(out, codes, stat[selected][:, columns])
+            return out
+
+        count = combine(cube.count, np.add, 0)
+        if how == 'count':
+            return pd.DataFrame(count.astype(np.int64), index=index, columns=measures)
+        if how in ('min', 'max'):
+            extreme = combine(cube.min, np.fmin, np.nan) if how == 'min' else combine(cube.max, np.fmax, np.nan)
+            return pd.DataFrame(extreme, index=index, columns=measures)
+        total = combine(cube.sum, np.add, 0)
+        if how == 'sum':
+            result = pd.DataFrame(total, index=index, columns=measures)
+            return result.astype({measure: np.int64 for measure in measures if measure in self.integer_measures})
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, np.nan)
+            if how == 'mean':
+                return pd.DataFrame(mean, index=index, columns=measures)
+            shifted_total = total - count * self.shifts[measures].to_numpy()
+            variance = (combine(cube.sumsq, np.add, 0) - shifted_total ** 2 / count) / (count - 1)
+            variance = np.where(count > 1, np.maximum(variance, 0), np.nan)
+        return pd.DataFrame(np.sqrt(variance) if how == 'std' else variance, index=index, columns=measures)
+
+def numeric_columns_of(df, group_by):
+    return [column for column in df.columns if is_measure(df[column]) and column not in group_by]
+
+def group_aggregate(df, group_by, how, measures=None, cubes=None, conditions=None, fold_case=False, sort=True):
+    # groupby(group_by, sort=sort)[measures].<how>() of df, where df is the
+    # dataset already filtered by conditions. With cubes built over the
+    # unfiltered dataset the answer comes from them whenever they cover the
+    # request. how is 'sum', 'mean', 'count', 'min', 'max', 'var', 'std' or
+    # 'size'; without sort the groups come in the order they first appear in df
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    if measures is None:
+        measures = numeric_columns_of(df, group_by)
+    if cubes is not None:
+        answer = cubes.aggregate(group_by, measures, how, conditions, fold_case)
+        if answer is not None:
+            return answer if sort else answer.reindex(first_seen(df, group_by))
+    grouped = df.groupby(group_by, observed=True, sort=sort)
+    if how == 'size':
+        return grouped.size()
+    return getattr(grouped[measures], how)()
+
+def first_seen(df, group_by):
+    # The groups of df in the order their first row comes
+    if len(group_by) == 1:
+        return pd.Index(df[group_by[0]].dropna().unique(), name=group_by[0])
+    return pd.MultiIndex.from_frame(df[group_by].dropna().drop_duplicates())
+
+def value_counts(df, column, cubes=None, conditions=None, fold_case=False):
+    # df[column].value_counts() with the same cube shortcut
+    counts = group_aggregate(df, column, 'size', [], cubes, conditions, fold_case)
+    return counts[counts > 0].sort_values(ascending=False, kind='stable').rename('count')
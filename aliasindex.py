@@ -0,0 +1,83 @@
+from collections import deque
+
+# Aho-Corasick index over the column aliases from generate_column_aliases.
+# It is built once, and finding every alias in a request is then one pass
+# over the request text, however many columns and aliases there are.
+# Matching is case insensitive and, like the `alias in request_lower` scans
+# it replaces, works on substrings. Overlapping hits keep the leftmost,
+# longest alias, so 'device type' wins over a 'device' or 'type' alias.
+
+class AliasIndex:
+    def __init__(self, column_aliases):
+        # Lowercased alias -> column, the first column to claim an alias wins
+        self.aliases = {}
+        for alias, column in column_aliases.items():
+            self.aliases.setdefault(alias.lower(), column)
+
+        # Trie: per node its transitions, failure link, the alias ending there
+        # (length, column) and the next node on the failure chain with an alias
+        self.transitions = [{}]
+        self.outputs = [None]
+        for alias, column in self.aliases.items():
+            if not alias:
+                continue
+            node = 0
+            for char in alias:
+                next_node = self.transitions[node].get(char)
+                if next_node is None:
+                    next_node = len(self.transitions)
+                    self.transitions[node][char] = next_node
+                    self.transitions.append({})
+                    self.outputs.append(None)
+                node = next_node
+            self.outputs[node] = (len(alias), column)
+
+        self.fail = [0] * len(self.transitions)
+        self.output_links = [None] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.transitions[fail]:
+                    fail = self.fail[fail]
+                fail = self.transitions[fail].get(char, 0)
+                self.fail[child] = fail
+                self.output_links[child] = fail if self.outputs[fail] else self.output_links[fail]
+                queue.append(child)
+
+    def lookup(self, text):
+        # Exact alias -> column, e.g. the word after 'group by'
+        return self.aliases.get(text.strip().lower())
+
+    def iter_matches(self, text):
+        # Every alias occurrence as (start, end, column), overlaps included
+        node = 0
+        for position, char in enumerate(text.lower()):
+            while node and char not in self.transitions[node]:
+                node = self.fail[node]
+            node = self.transitions[node].get(char, 0)
+            hit = node if self.outputs[node] else self.output_links[node]
+            while hit:
+                length, column = self.outputs[hit]
+                yield position + 1 - length, position + 1, column
+                hit = self.output_links[hit]
+
+    def find_all(self, text):
+        # Non overlapping spans, preferring the leftmost then longest alias
+        matches = sorted(self.iter_matches(text), key=lambda match: (match[0], match[0] - match[1]))
+        spans = []
+        covered_until = 0
+        for start, end, column in matches:
+            if start >= covered_until:
+                spans.append((start, end, column))
+                covered_until = end
+        return spans
+
+    def columns_in(self, text):
+        # Columns mentioned in the text, in order of first appearance
+        columns = []
+        for start, end, column in self.find_all(text):
+            if column not in columns:
+                columns.append(column)
+        return columns
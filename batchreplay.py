@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import statistics
+import websockets
+import server
+from requestdsl import QuerySyntaxError
+
+# Replays a JSONL file of {"request": ..., "api_key": ...} records through the
+# chart pipeline: parse -> fetch -> render. By default it runs the pipeline in
+# process (throughput regression runs), with --server it sends the requests to
+# a running chart server instead so that server's caches get warmed.
+#
+#   python batchreplay.py requests.jsonl --output replay_out --concurrency 16
+#   python batchreplay.py requests.jsonl --server ws://localhost:8765
+
+def read_records(path):
+    # Streamed line by line, the file can be much bigger than memory
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                yield line_number, record['request'], record.get('api_key', '')
+            except (ValueError, KeyError) as e:
+                print(f"Skipping line {line_number}: {str(e)}")
+
+async def replay_local(request, api_key, output_format, timings):
+    if output_format == 'json':
+        # Parse and fetch only, no rendering
+        try:
+            query = server.parse_chart_request(request, timings)
+        except QuerySyntaxError as e:
+            return None, f"Invalid request: {str(e)}"
+        api_data, data_cache = await server.load_query_data(query, api_key, server.query_cache_key(query, api_key), timings)
+        if not api_data:
+            return None, "Failed to fetch data from API."
+        return json.dumps(api_data).encode('utf-8'), None
+    return await server.process_request(request, api_key, timings)
+
+class RemoteSession:
+    # One WebSocket session to the chart server, many requests in flight on it
+    def __init__(self, uri):
+        self.uri = uri
+        self.pending = {}
+
+    async def __aenter__(self):
+        self.websocket = await websockets.connect(self.uri, max_size=None)
+        self.reader = asyncio.create_task(self.read_responses())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.websocket.close()
+        await self.reader
+
+    async def read_responses(self):
+        header = None
+        try:
+            async for message in self.websocket:
+                if isinstance(message, bytes):
+                    response, header = header, None
+                    if response is None:
+                        continue
+                    response['image'] = message
+                else:
+                    response = json.loads(message)
+                    if response['status'] == 'ok':
+                        header = response
+                        continue
+                future = self.pending.pop(response.get('request_id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to chart server closed"))
+
+    async def request(self, request_id, request, api_key):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        await self.websocket.send(json.dumps({'request_id': request_id, 'request': request, 'api_key': api_key}))
+        return await future
+
+    async def replay(self, request_id, request, api_key, timings):
+        start = time.perf_counter()
+        response = await self.request(request_id, request, api_key)
+        server.record_timing(timings, 'round_trip', start)
+        # The server reports its own stage timings in milliseconds
+        for stage, milliseconds in response.get('timings', {}).items():
+            timings[stage] = milliseconds / 1000
+        if response['status'] != 'ok':
+            return None, response['message']
+        return response['image'], None
+
+def write_result(output_dir, line_number, output_format, payload, error):
+    name = f"{line_number:06d}"
+    if error:
+        with open(os.path.join(output_dir, f"{name}.error.json"), 'w') as f:
+            json.dump({'line': line_number, 'error': error}, f)
+        return
+    extension = 'json' if output_format == 'json' else 'png'
+    with open(os.path.join(output_dir, f"{name}.{extension}"), 'wb') as f:
+        f.write(payload)
+
+def summarize(stage_timings, totals, failures, elapsed):
+    summary = {
+        'requests': len(totals),
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(totals) / elapsed, 2) if elapsed else 0,
+        'stages': {},
+    }
+    for stage, samples in sorted(stage_timings.items()):
+        samples.sort()
+        summary['stages'][stage] = {
+            'count': len(samples),
+            'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+            'p50_ms': round(samples[len(samples) // 2] * 1000, 2),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+        }
+    return summary
+
+async def replay(path, output_dir, concurrency, output_format, server_uri=None):
+    os.makedirs(output_dir, exist_ok=True)
+    records = read_records(path)
+    stage_timings = {}
+    totals = []
+    failures = 0
+
+    async def run(session):
+        nonlocal failures
+        # Each worker pulls the next record from the shared generator, so at
+        # most `concurrency` requests are in flight and the file is never
+        # loaded whole
+        for line_number, request, api_key in records:
+            timings = {}
+            start = time.perf_counter()
+            try:
+                if session is not None:
+                    payload, error = await session.replay(str(line_number), request, api_key, timings)
+                else:
+                    payload, error = await replay_local(request, api_key, output_format, timings)
+            except Exception as e:
+                payload, error = None, f"Error: {str(e)}"
+            server.record_timing(timings, 'total', start)
+            totals.append(timings['total'])
+            if error:
+                failures += 1
+            write_result(output_dir, line_number, output_format, payload, error)
+            for stage, seconds in timings.items():
+                stage_timings.setdefault(stage, []).append(seconds)
+
+    start = time.perf_counter()
+    if server_uri:
+        async with RemoteSession(server_uri) as session:
+            await asyncio.gather(*[run(session) for _ in range(concurrency)])
+    else:
+        if output_format == 'png':
+            await server.warm_render_pool()
+        try:
+            await asyncio.gather(*[run(None) for _ in range(concurrency)])
+        finally:
+            await server.close_upstream_session()
+            server.shutdown_render_pool()
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(stage_timings, totals, failures, elapsed)
+    if not server_uri:
+        summary['cache'] = server.cache_stats()
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay chart requests from a JSONL file")
+    parser.add_argument('input', help="JSONL file with one {request, api_key} object per line")
+    parser.add_argument('--output', default='replay_output', help="directory for charts, results and summary.json")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at once")
+    parser.add_argument('--format', choices=['png', 'json'], default='png', help="render charts or only fetch the data")
+    parser.add_argument('--server', help="replay against a running chart server, e.g. ws://localhost:8765")
+    args = parser.parse_args()
+
+    if args.server and args.format == 'json':
+        parser.error("--format json is only available for in-process replay")
+
+    summary = asyncio.run(replay(args.input, args.output, args.concurrency, args.format, args.server))
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from aiohttp import web
+import batchreplay
+from requestdsl import parse_query
+
+# Offline load benchmark for the WebSocket chart server:
+#
+#   python benchmark.py upstream --port 18080 --latency 0.05 --rows 200
+#       local stand-in for the /data upstream
+#   python benchmark.py load --uri ws://localhost:8765 --rate 50 --duration 30
+#       replays DSL requests against a running server at a fixed rate
+#   python benchmark.py run --rate 50 --duration 30 --output bench.json
+#       starts the stand-in and a server.py pointed at it, runs the load and
+#       reports p50/p95/p99 per stage (parse, fetch, dataframe, draw, encode)
+
+DEFAULT_REQUESTS = [
+    'sum bytesFromClient+bytesFromServer group by appName order by value chart pie order descending limit 5',
+    'sum bytesFromClient+bytesFromServer group by appName order by value chart bar order descending limit 10',
+    'sum bytesFromClient group by appName chart table limit 20',
+    'sum lostBytesClient group by appName chart line',
+    'sum srttMsClient srttMsServer group by appName chart scatter',
+]
+
+STAGES = ['parse', 'fetch', 'dataframe', 'draw', 'encode', 'render', 'coalesced', 'total']
+
+def make_upstream_app(latency, jitter, rows):
+    payloads = {}
+
+    async def data(request):
+        await asyncio.sleep(max(0, latency + random.uniform(-jitter, jitter)))
+        # Same shape as the real /data answer for a grouped sum: one row per
+        # group with the summed value, cached per group_by column
+        group_by = request.query.get('group_by', 'appName')
+        if group_by not in payloads:
+            payloads[group_by] = json.dumps([{group_by: f"{group_by}_{i}", 'value': random.randint(1, 10 ** 6)} for i in range(rows)])
+        return web.Response(text=payloads[group_by], content_type='application/json')
+
+    app = web.Application()
+    app.router.add_get('/data', data)
+    return app
+
+async def start_upstream(host, port, latency, jitter, rows):
+    runner = web.AppRunner(make_upstream_app(latency, jitter, rows))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def load_requests(path):
+    if path is None:
+        return [(request, 'bench') for request in DEFAULT_REQUESTS]
+    return [(request, api_key) for line_number, request, api_key in batchreplay.read_records(path)]
+
+def bust_cache(request, i):
+    # A filter the stand-in ignores but that makes every request distinct,
+    # so each one goes through fetch and render instead of the caches
+    if parse_query(request).filter is not None:
+        return request
+    return f"{request} filter by benchRun = {i}"
+
+def percentile(samples, fraction):
+    # Nearest rank on an already sorted list
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def build_report(stage_samples, errors, sent, elapsed, max_lag):
+    report = {
+        'sent': sent,
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'achieved_rate': round(sent / elapsed, 2) if elapsed else 0,
+        'max_schedule_lag_ms': round(max_lag * 1000, 2),
+        'stages': {},
+    }
+    for stage in STAGES + sorted(set(stage_samples) - set(STAGES)):
+        samples = sorted(stage_samples.get(stage, []))
+        if not samples:
+            continue
+        report['stages'][stage] = {
+            'count': len(samples),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+        }
+    return report
+
+async def generate_load(uri, requests, rate, duration, connections, cache_busting):
+    stage_samples = {}
+    errors = 0
+    max_lag = 0
+    total = max(1, int(rate * duration))
+
+    async def one(session, i, request, api_key):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            response = await session.request(str(i), request, api_key)
+        except Exception as e:
+            print(f"Request {i} failed: {str(e)}")
+            errors += 1
+            return
+        stage_samples.setdefault('total', []).append(time.perf_counter() - start)
+        if response['status'] != 'ok':
+            errors += 1
+        for stage, milliseconds in response.get('timings', {}).items():
+            stage_samples.setdefault(stage, []).append(milliseconds / 1000)
+
+    async with contextlib.AsyncExitStack() as stack:
+        sessions = [await stack.enter_async_context(batchreplay.RemoteSession(uri)) for _ in range(connections)]
+        tasks = []
+        start = time.perf_counter()
+        # Open loop: requests go out on schedule whether or not earlier ones
+        # have been answered, so a slow server shows up as latency
+        for i in range(total):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            request, api_key = requests[i % len(requests)]
+            if cache_busting:
+                request = bust_cache(request, i)
+            tasks.append(asyncio.create_task(one(sessions[i % connections], i, request, api_key)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return build_report(stage_samples, errors, total, elapsed, max_lag)
+
+async def wait_for_server(uri, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with batchreplay.RemoteSession(uri):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+def stop_server(server_process, timeout=30):
+    # SIGINT, so the server's asyncio.run unwinds and shuts its render
+    # workers down rather than leaving them holding our output open
+    if os.name == 'nt':
+        server_process.terminate()
+    else:
+        server_process.send_signal(signal.SIGINT)
+    try:
+        server_process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        server_process.kill()
+        server_process.wait()
+
+async def run_benchmark(args):
+    upstream = await start_upstream('127.0.0.1', args.upstream_port, args.latency, args.jitter, args.rows)
+    env = dict(os.environ,
+               CHART_UPSTREAM_URL=f"http://127.0.0.1:{args.upstream_port}/data",
+               CHART_SERVER_HOST='127.0.0.1',
+               CHART_SERVER_PORT=str(args.port))
+    server_process = subprocess.Popen([sys.executable, 'server.py'], env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    uri = f"ws://127.0.0.1:{args.port}"
+    try:
+        await wait_for_server(uri, args.startup_timeout)
+        return await generate_load(uri, load_requests(args.requests), args.rate, args.duration, args.connections, not args.allow_cache)
+    finally:
+        stop_server(server_process)
+        await upstream.cleanup()
+
+async def serve_upstream(args):
+    runner = await start_upstream(args.host, args.port, args.latency, args.jitter, args.rows)
+    print(f"Stand-in upstream on http://{args.host}:{args.port}/data")
+    try:
+        await asyncio.Future()
+    finally:
+        await runner.cleanup()
+
+def add_upstream_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds the stand-in waits before answering")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random +/- seconds added to the latency")
+    parser.add_argument('--rows', type=int, default=20, help="rows in each /data answer")
+
+def add_load_arguments(parser):
+    parser.add_argument('--requests', help="JSONL file of {request, api_key} records, defaults to a built-in mix")
+    parser.add_argument('--rate', type=float, default=20, help="requests per second")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of load")
+    parser.add_argument('--connections', type=int, default=4, help="WebSocket sessions to spread requests over")
+    parser.add_argument('--allow-cache', action='store_true', help="send requests as-is and let the server caches answer repeats")
+    parser.add_argument('--output', help="also write the report to this JSON file")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for the WebSocket chart server")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    upstream_parser = commands.add_parser('upstream', help="run the stand-in /data upstream")
+    upstream_parser.add_argument('--host', default='127.0.0.1')
+    upstream_parser.add_argument('--port', type=int, default=18080)
+    add_upstream_arguments(upstream_parser)
+
+    load_parser = commands.add_parser('load', help="generate load against a running server")
+    load_parser.add_argument('--uri', default='ws://localhost:8765')
+    add_load_arguments(load_parser)
+
+    run_parser = commands.add_parser('run', help="start the stand-in and a server, then generate load")
+    run_parser.add_argument('--port', type=int, default=18765, help="port for the benchmarked server")
+    run_parser.add_argument('--upstream-port', type=int, default=18080)
+    run_parser.add_argument('--startup-timeout', type=float, default=60)
+    add_upstream_arguments(run_parser)
+    add_load_arguments(run_parser)
+
+    args = parser.parse_args()
+    if args.command == 'upstream':
+        asyncio.run(serve_upstream(args))
+        return
+    if args.command == 'load':
+        report = asyncio.run(generate_load(args.uri, load_requests(args.requests), args.rate, args.duration, args.connections, not args.allow_cache))
+    else:
+        report = asyncio.run(run_benchmark(args))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
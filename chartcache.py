@@ -0,0 +1,98 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# Size bounded LRU cache with a time to live on every entry, used by the
+# chart server for upstream JSON and rendered charts. Not thread safe, it is
+# only touched from the server's event loop.
+class LRUCache:
+    def __init__(self, name, max_entries, max_bytes, ttl):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, size, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size, ttl=None):
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        self.entries[key] = (value, size, expires_at)
+        self.total_bytes += size
+        # Evict least recently used entries until we're back under both limits
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        value, size, expires_at = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+        }
+
+# Single flight deduplication: concurrent calls with the same key share one
+# in progress task instead of each doing the work. The task is shielded so a
+# caller going away (client disconnect) doesn't cancel it for the others.
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}  # key -> task
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+    def stats(self):
+        return {
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'in_flight': len(self.calls),
+        }
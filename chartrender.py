@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import time
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from PIL import Image
+import pandas as pd
+from topk import top_k
+from figurepool import FigurePool
+from chartspecs import CHART_SPECS, Binned, ChartSpecError, prepare_chart, render_chart as render_spec
+from outputformat import DEFAULT_DPI, PNG
+
+# Chart rendering for the WebSocket server. Everything here runs inside the
+# render pool worker processes and only uses the object-oriented Figure API,
+# so no pyplot global state is shared between concurrent renders. Large
+# inputs go through the reduction stage first, so the drawing cost is bounded
+# by the figure size rather than by the number of rows. The charts themselves
+# are the chartspecs registry, shared with the scripts.
+
+def init_worker():
+    # Warm up the Agg backend once per worker: the first savefig pays for
+    # font cache loading and backend imports, we don't want a client to see it
+    matplotlib.use('Agg')
+    fig = Figure(figsize=(2, 2))
+    ax = fig.subplots()
+    ax.plot([0, 1], [0, 1])
+    ax.set_title('warm up')
+    fig.savefig(io.BytesIO(), format='png')
+
+def worker_pid():
+    return os.getpid()
+
+def draw_chart(df, chart_type, dpi=DEFAULT_DPI):
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
+        print("Chart type not supported")
+        return None
+    fig = Figure(figsize=spec.figsize, dpi=dpi)
+    try:
+        render_spec(fig, chart_type, df, df.columns)
+    except ChartSpecError as e:
+        print(f"Cannot draw {chart_type} chart: {str(e)}")
+        return None
+    return fig
+
+def json_data(data):
+    if isinstance(data, Binned):
+        return {'grid': data.grid.filled(0).tolist(), 'x_edges': data.x_edges.tolist(),
+                'y_edges': data.y_edges.tolist(), 'label': data.label}
+    # Frames as columns plus rows, shares and crosstabs with their labels
+    return json.loads(data.to_json(orient='split', index=data.index.name is not None))
+
+def chart_json(df, chart_type):
+    # The chart without drawing it: its type and the aggregated, reduced data
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
+        print("Chart type not supported")
+        return None
+    try:
+        spec, data, note = prepare_chart(chart_type, df, df.columns, spec.figsize)
+    except ChartSpecError as e:
+        print(f"Cannot draw {chart_type} chart: {str(e)}")
+        return None
+    return json.dumps({
+        'chart_type': chart_type,
+        'columns': [str(column) for column in df.columns],
+        'aggregation': spec.aggregation,
+        'reduction': spec.reduction,
+        'note': note,
+        'data': json_data(data),
+    }).encode('utf-8')
+
+# Templates of the charts this worker drew last, see figurepool
+figure_pool = FigurePool(draw_chart)
+
+def render_chart_timed(data, chart_type, top=None, output=PNG):
+    # Returns the chart as bytes in the output format (an OutputFormat) and
+    # the seconds spent in each rendering stage. top is
+    # requestdsl.top_k_spec's (column, count, largest) or None
+    timings = {}
+    start = time.perf_counter()
+    df = pd.DataFrame(data)
+    if top is not None and top[0] in df.columns:
+        df = top_k(df, *top)
+    if df.shape[1] == 1 and chart_type != 'table':
+        # A lone value column is drawn against its row positions
+        df = df.reset_index()
+    timings['dataframe'] = time.perf_counter() - start
+
+    if output.kind == 'json':
+        start = time.perf_counter()
+        payload = chart_json(df, chart_type)
+        timings['encode'] = time.perf_counter() - start
+        return payload, timings
+
+    start = time.perf_counter()
+    fig = figure_pool.figure(df, chart_type, output.dpi)
+    if fig is None:
+        return None, timings
+    if output.kind == 'svg':
+        timings['draw'] = time.perf_counter() - start
+        # Written straight from the artists, nothing is rasterized
+        start = time.perf_counter()
+        img = io.BytesIO()
+        fig.savefig(img, format='svg')
+        timings['encode'] = time.perf_counter() - start
+        return img.getvalue(), timings
+    canvas = fig.canvas
+    canvas.draw()
+    timings['draw'] = time.perf_counter() - start
+
+    # Encode the Agg buffer directly rather than calling savefig, which would
+    # draw the figure a second time
+    start = time.perf_counter()
+    width, height = canvas.get_width_height(physical=True)
+    img = io.BytesIO()
+    Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).save(img, format='png', compress_level=output.compression)
+    timings['encode'] = time.perf_counter() - start
+    return img.getvalue(), timings
@@ -0,0 +1,283 @@
+from dataclasses import dataclass
+import pandas as pd
+import seaborn as sns
+from aggcubes import group_aggregate, value_counts
+from reduction import SCATTER_MAX_POINTS, pixel_size, reduce_line, grid_bins, sample_rows, truncate_table
+
+# One registry of chart renderers, shared by the server and the scripts.
+# Each ChartSpec declares what it needs from the request:
+#   min_columns  how many columns the chart is drawn from, in request order
+#   numeric      positions of the columns that must be numeric
+#   aggregation  how the rows are summarized before drawing (AGGREGATIONS)
+#   reduction    how large inputs are cut down to what the figure can show
+#                (REDUCTIONS)
+# validate_chart checks a request against the spec with nothing but the
+# column names and, when known, their kinds, so an impossible chart is
+# rejected before any data is fetched or loaded. render_chart then runs the
+# aggregation, the reduction and the drawing on a matplotlib Figure.
+
+NUMERIC_KINDS = ('int', 'float')
+
+class ChartSpecError(ValueError):
+    pass
+
+@dataclass(frozen=True)
+class ChartSpec:
+    name: str
+    draw: object
+    min_columns: int = 1
+    numeric: tuple = ()
+    aggregation: str = None
+    reduction: str = None
+    figsize: tuple = (10, 6)
+
+    def check(self, columns, kinds=None):
+        # Raises ChartSpecError if the chart cannot be drawn from columns,
+        # kinds maps column -> 'int', 'float', 'category'... (unknown columns
+        # are not checked)
+        if len(columns) < self.min_columns:
+            raise ChartSpecError(f"A {self.name} chart needs at least {self.min_columns} column{'s' if self.min_columns > 1 else ''}, got {len(columns)}")
+        for position in self.numeric:
+            if position < len(columns):
+                kind = (kinds or {}).get(columns[position])
+                if kind is not None and kind not in NUMERIC_KINDS:
+                    raise ChartSpecError(f"Column '{columns[position]}' must be numeric for a {self.name} chart")
+
+def column_kinds(df):
+    # The kinds validate_chart expects, from the dtypes of a loaded frame
+    kinds = {}
+    for column in df.columns:
+        dtype = df[column].dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            kinds[column] = 'category'
+        elif pd.api.types.is_integer_dtype(dtype):
+            kinds[column] = 'int'
+        elif pd.api.types.is_float_dtype(dtype):
+            kinds[column] = 'float'
+        elif not pd.api.types.is_datetime64_any_dtype(dtype):
+            kinds[column] = 'category'
+    return kinds
+
+def is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+def title_of(column):
+    return str(column).capitalize()
+
+# Aggregations: (df, columns, cubes, conditions, fold_case) -> what draw gets.
+# cubes may only be given when df is the dataset filtered by conditions.
+
+def aggregate_mean(df, columns, cubes, conditions, fold_case):
+    # Mean of the second column per value of the first, in the order the
+    # values first come in df (the caller may have ordered the rows)
+    means = group_aggregate(df, columns[0], 'mean', [columns[1]], cubes, conditions, fold_case, sort=False)
+    return means.reset_index()
+
+def aggregate_share(df, columns, cubes, conditions, fold_case):
+    # Rows per value of the first column, or the second column summed per
+    # value of the first in the order the values first come in df
+    if len(columns) == 1:
+        return value_counts(df, columns[0], cubes, conditions, fold_case)
+    return group_aggregate(df, columns[0], 'sum', [columns[1]], cubes, conditions, fold_case, sort=False)[columns[1]]
+
+def aggregate_crosstab(df, columns, cubes, conditions, fold_case):
+    # Rows per pair of values of the first two columns
+    sizes = group_aggregate(df, list(columns[:2]), 'size', [], cubes, conditions, fold_case)
+    return sizes.unstack(fill_value=0)
+
+AGGREGATIONS = {
+    'mean': aggregate_mean,
+    'share': aggregate_share,
+    'crosstab': aggregate_crosstab,
+}
+
+# Reductions: (data, columns, figsize, dpi) -> (data, note or None)
+
+def reduce_lttb(df, columns, figsize, dpi):
+    return reduce_line(df, columns[0], list(columns[1:2]), pixel_size(figsize, dpi)[0]), None
+
+def reduce_minmax(df, columns, figsize, dpi):
+    return reduce_line(df, columns[0], list(columns[1:2]), pixel_size(figsize, dpi)[0], method='minmax'), None
+
+class Binned:
+    # A scatter counted on a grid, drawn as a heatmap
+    def __init__(self, grid, x_edges, y_edges, label):
+        self.grid = grid
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        self.label = label
+
+def bin_points(df, columns, figsize, dpi, weight_column=None):
+    # Past SCATTER_MAX_POINTS the points are counted on a grid, or their
+    # weight_column summed per cell. Text axes cannot be binned and are
+    # sampled instead
+    if len(df) <= SCATTER_MAX_POINTS:
+        return df
+    if not is_numeric(df[columns[0]]) or not is_numeric(df[columns[1]]):
+        return sample_rows(df, SCATTER_MAX_POINTS)
+    weights = df[weight_column] if weight_column is not None else None
+    label = title_of(weight_column) if weight_column is not None else 'Rows'
+    return Binned(*grid_bins(df[columns[0]], df[columns[1]], figsize, dpi, weights), label)
+
+def reduce_grid(df, columns, figsize, dpi):
+    if len(columns) > 2:
+        # Colored by the third column, so thinned out rather than binned
+        return sample_rows(df, SCATTER_MAX_POINTS), None
+    return bin_points(df, columns, figsize, dpi), None
+
+def reduce_weighted_grid(df, columns, figsize, dpi):
+    # Bubble sizes summed per cell
+    return bin_points(df, columns, figsize, dpi, columns[2]), None
+
+def reduce_sample(df, columns, figsize, dpi):
+    return sample_rows(df, SCATTER_MAX_POINTS), None
+
+def reduce_table(df, columns, figsize, dpi):
+    return truncate_table(df[list(columns)])
+
+REDUCTIONS = {
+    'lttb': reduce_lttb,
+    'minmax': reduce_minmax,
+    'grid': reduce_grid,
+    'weighted_grid': reduce_weighted_grid,
+    'sample': reduce_sample,
+    'table': reduce_table,
+}
+
+# Drawing: (fig, ax, data, columns), on the Figure API only
+
+def label_axes(ax, x, y):
+    ax.set_xlabel(title_of(x))
+    ax.set_ylabel(title_of(y))
+
+def draw_binned(fig, ax, binned, columns):
+    mesh = ax.pcolormesh(binned.x_edges, binned.y_edges, binned.grid)
+    fig.colorbar(mesh, ax=ax, label=binned.label)
+    label_axes(ax, columns[0], columns[1])
+
+def draw_table(fig, ax, df, columns):
+    ax.axis('tight')
+    ax.axis('off')
+    table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(10)
+    table.scale(1.2, 1.2)
+    ax.set_title('Table')
+
+def draw_bar(fig, ax, df, columns):
+    df.plot(kind='bar', x=columns[0], y=[columns[1]], ax=ax)
+    label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[1])} by {title_of(columns[0])}')
+
+def draw_histogram(fig, ax, df, columns):
+    ax.hist(df[columns[0]].dropna(), bins=20)
+    label_axes(ax, columns[0], 'Frequency')
+    ax.set_title(f'{title_of(columns[0])} Histogram')
+
+def draw_line(fig, ax, df, columns):
+    ax.plot(df[columns[0]], df[columns[1]], label=title_of(columns[1]))
+    label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[0])} Line Plot')
+    ax.legend()
+
+def draw_pie(fig, ax, shares, columns):
+    ax.pie(shares.to_numpy(), labels=shares.index, autopct='%1.1f%%', startangle=140)
+    if len(columns) > 1:
+        ax.set_title(f'{title_of(columns[1])} by {title_of(columns[0])}')
+    else:
+        ax.set_title(f'{title_of(columns[0])} Distribution')
+
+def draw_scatter(fig, ax, data, columns):
+    if isinstance(data, Binned):
+        draw_binned(fig, ax, data, columns)
+    elif len(columns) > 2:
+        sns.scatterplot(data=data, x=columns[0], y=columns[1], hue=columns[2], ax=ax)
+    else:
+        ax.scatter(data[columns[0]], data[columns[1]])
+        label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[1])} vs {title_of(columns[0])}')
+
+def draw_box(fig, ax, df, columns):
+    sns.boxplot(x=columns[0], y=columns[1], data=df, ax=ax)
+    label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[1])} by {title_of(columns[0])}')
+
+def draw_violin(fig, ax, df, columns):
+    sns.violinplot(x=columns[0], y=columns[1], data=df, ax=ax)
+    label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[1])} Distribution by {title_of(columns[0])}')
+
+def draw_heatmap(fig, ax, crosstab, columns):
+    sns.heatmap(crosstab, ax=ax)
+    label_axes(ax, columns[1], columns[0])
+    ax.set_title(f'{title_of(columns[0])} vs {title_of(columns[1])} Heatmap')
+
+def draw_area(fig, ax, df, columns):
+    ax.fill_between(df[columns[0]], df[columns[1]], alpha=0.5)
+    label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[1])} vs {title_of(columns[0])}')
+
+def draw_bubble(fig, ax, data, columns):
+    if isinstance(data, Binned):
+        draw_binned(fig, ax, data, columns)
+    else:
+        ax.scatter(data[columns[0]], data[columns[1]], s=data[columns[2]] * 100, alpha=0.5)
+        label_axes(ax, columns[0], columns[1])
+    ax.set_title(f'{title_of(columns[1])} vs {title_of(columns[0])} (Bubble Chart)')
+
+CHART_SPECS = {spec.name: spec for spec in [
+    ChartSpec('table', draw_table, reduction='table', figsize=(12, 4)),
+    ChartSpec('bar', draw_bar, min_columns=2, numeric=(1,), aggregation='mean'),
+    ChartSpec('histogram', draw_histogram, numeric=(0,)),
+    ChartSpec('line', draw_line, min_columns=2, numeric=(1,), reduction='lttb'),
+    ChartSpec('pie', draw_pie, numeric=(1,), aggregation='share', figsize=(8, 8)),
+    ChartSpec('scatter', draw_scatter, min_columns=2, numeric=(1,), reduction='grid'),
+    ChartSpec('box', draw_box, min_columns=2, numeric=(1,)),
+    ChartSpec('violin', draw_violin, min_columns=2, numeric=(1,), reduction='sample'),
+    ChartSpec('heatmap', draw_heatmap, min_columns=2, aggregation='crosstab'),
+    ChartSpec('area', draw_area, min_columns=2, numeric=(1,), reduction='minmax'),
+    ChartSpec('bubble', draw_bubble, min_columns=3, numeric=(1, 2), reduction='weighted_grid'),
+]}
+
+CHART_TYPES = tuple(CHART_SPECS)
+
+def chart_spec(chart_type):
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
+        raise ChartSpecError(f"Chart type '{chart_type}' not supported")
+    return spec
+
+def validate_chart(chart_type, columns, kinds=None):
+    # The spec for chart_type if it can be drawn from columns, raises
+    # ChartSpecError otherwise. Meant to run before the data is loaded
+    spec = chart_spec(chart_type)
+    spec.check(list(columns), kinds)
+    return spec
+
+def prepare_chart(chart_type, df, columns, figsize, dpi=100, cubes=None, conditions=None, fold_case=False):
+    # (spec, data, note): what the chart draws from df's columns at that
+    # figure size, after its aggregation and reduction. Raises
+    # ChartSpecError if df cannot give that chart
+    columns = list(columns)
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ChartSpecError(f"Columns not in the data: {', '.join(map(str, missing))}")
+    spec = validate_chart(chart_type, columns, column_kinds(df))
+    data = df
+    if spec.aggregation is not None:
+        data = AGGREGATIONS[spec.aggregation](df, columns, cubes, conditions, fold_case)
+    note = None
+    if spec.reduction is not None:
+        data, note = REDUCTIONS[spec.reduction](data, columns, figsize, dpi)
+    return spec, data, note
+
+def render_chart(fig, chart_type, df, columns, cubes=None, conditions=None, fold_case=False):
+    # Draws chart_type of df's columns on fig, raises ChartSpecError if df
+    # cannot give that chart
+    columns = list(columns)
+    spec, data, note = prepare_chart(chart_type, df, columns, fig.get_size_inches(), fig.dpi, cubes, conditions, fold_case)
+    ax = fig.subplots()
+    spec.draw(fig, ax, data, columns)
+    if note:
+        ax.set_title(f'{ax.get_title()} ({note})')
+    return ax
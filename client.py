@@ -1,58 +1,125 @@
 import asyncio
+import threading
+import uuid
 import websockets
 import json
-import base64
-import io
-import os
 import streamlit as st
 
-# Function to connect to the server and fetch the chart
-async def connect_to_server(request_data):
-    uri = "ws://localhost:8765"
-    async with websockets.connect(uri) as websocket:
-        await websocket.send(json.dumps(request_data))
-        print(f"Sent request: {request_data['request']}")
-
-        response = await websocket.recv()
-        if response.startswith("Error"):
-            print(f"Received server response: {response}")
-            return response
-        else:
-            try:
-                img_bytes = base64.b64decode(response)
-                img_path = os.path.join(os.getcwd(), 'chart.png')
-                with open(img_path, 'wb') as f:
-                    f.write(img_bytes)
-                print(f"Received chart image saved to: {img_path}")
-                return img_path
-            except Exception as e:
-                print(f"Failed to decode image: {str(e)}")
-                return None
+SERVER_URI = "ws://localhost:8765"
+REQUEST_TIMEOUT = 60  # seconds to wait for one chart
+
+# Keeps a single WebSocket session open in a background event loop thread.
+# Streamlit reruns the script on every interaction, so the connection has to
+# live outside of it; requests are matched to responses by request_id.
+class ChartClient:
+    def __init__(self, uri):
+        self.uri = uri
+        self.websocket = None
+        self.reader_task = None
+        self.pending = {}
+        self.connect_lock = asyncio.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def _connect(self):
+        async with self.connect_lock:
+            if self.websocket is None:
+                self.websocket = await websockets.connect(self.uri)
+                # Kept so the loop holds a reference to it while it runs
+                self.reader_task = asyncio.create_task(self._read_responses(self.websocket))
+            return self.websocket
+
+    async def _read_responses(self, websocket):
+        try:
+            header = None
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    # Binary frame: the PNG belonging to the previous header
+                    response, header = header, None
+                    if response is None:
+                        continue
+                    response['image'] = message
+                else:
+                    response = json.loads(message)
+                    if response['status'] == 'ok':
+                        header = response
+                        continue
+                future = self.pending.pop(response.get('request_id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            # Reconnect on the next request, fail whatever was still waiting
+            if self.websocket is websocket:
+                self.websocket = None
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to chart server closed"))
+
+    async def _request(self, request_data):
+        websocket = await self._connect()
+        request_id = uuid.uuid4().hex
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        await websocket.send(json.dumps({**request_data, 'request_id': request_id}))
+        print(f"Sent request {request_id}: {request_data['request']}")
+        try:
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _request_many(self, requests_data):
+        return await asyncio.gather(*[self._request(request_data) for request_data in requests_data], return_exceptions=True)
+
+    def fetch_chart(self, request_data):
+        return asyncio.run_coroutine_threadsafe(self._request(request_data), self.loop).result()
+
+    def fetch_charts(self, requests_data):
+        # All requests go out on the same connection and run concurrently
+        return asyncio.run_coroutine_threadsafe(self._request_many(requests_data), self.loop).result()
+
+@st.cache_resource
+def get_chart_client():
+    return ChartClient(SERVER_URI)
+
+def read_chart(response):
+    if isinstance(response, Exception):
+        print(f"Request failed: {str(response)}")
+        return f"Error: {str(response)}"
+    if response['status'] != 'ok':
+        print(f"Received server response: {response['message']}")
+        return response['message']
+    print(f"Received chart image ({len(response['image'])} bytes)")
+    return response['image']
+
+# Function to fetch the charts from the server over the shared connection,
+# charts come back as PNG bytes that st.image can show directly
+def connect_to_server(requests_data):
+    responses = get_chart_client().fetch_charts(requests_data)
+    return [read_chart(response) for response in responses]
 
 # Streamlit app code
 def main():
     st.title("Chart Generator")
 
-    # Input for user request and API key
+    # Input for user requests (one per line) and API key
     request = st.text_area("Enter your request:", value='sum bytesFromClient+bytesFromServer group by appName order by value chart pie order descending limit 5')
     api_key = st.text_input("Enter your API key:", value='a')
 
     # Button to submit request
     if st.button("Generate Chart"):
-        request_data = {
-            'request': request,
-            'api_key': api_key
-        }
-
-        # Run the async function in the Streamlit app
-        response = asyncio.run(connect_to_server(request_data))
-
-        if response is None:
-            st.error("Failed to fetch data from server.")
-        elif response.startswith("Error"):
-            st.error(f"Server returned an error: {response}")
-        else:
-            st.image(response, caption='Generated Chart', use_column_width=True)
+        requests_data = [{'request': line.strip(), 'api_key': api_key} for line in request.splitlines() if line.strip()]
+
+        for response in connect_to_server(requests_data):
+            if response is None:
+                st.error("Failed to fetch data from server.")
+            elif isinstance(response, str):
+                st.error(f"Server returned an error: {response}")
+            else:
+                st.image(response, caption='Generated Chart', use_column_width=True)
 
     # Set background style
     st.markdown("""
@@ -0,0 +1,105 @@
+import weakref
+import numpy as np
+import pandas as pd
+
+# Optional in-memory secondary indexes over a loaded dataset, built once by
+# index_dataset when the data is loaded:
+#   - numeric columns get a sorted positional index (argsort order plus the
+#     sorted values), so a range or equality is two binary searches and a
+#     slice of row positions
+#   - low cardinality text columns (Genre, Device_Type, Playback_Quality...)
+#     get one packed bitmap per value, so equality and IN are bitmap OR and
+#     several such filters a bitmap AND, without touching the column
+# filtercompiler uses whatever index is there and scans for the rest.
+
+MAX_BITMAP_CARDINALITY = 64
+# A sorted index is only worth it when the range keeps few rows, beyond this
+# fraction a straight comparison over the column is as fast
+INDEX_SELECTIVITY = 0.2
+
+dataset_indexes = {}  # id(df) -> DatasetIndex
+
+class DatasetIndex:
+    def __init__(self, df, columns=None, max_bitmap_cardinality=MAX_BITMAP_CARDINALITY):
+        self.rows = len(df)
+        self.sorted = {}  # column -> (order, sorted values, rows that are not NaN)
+        self.bitmaps = {}  # column -> {value: packed bits}
+        self.folded_bitmaps = {}  # column -> {lowercased value: packed bits}, built on demand
+        for column in columns if columns is not None else df.columns:
+            series = df[column]
+            if pd.api.types.is_bool_dtype(series.dtype):
+                continue
+            if pd.api.types.is_numeric_dtype(series.dtype):
+                values = series.to_numpy()
+                order = np.argsort(values, kind='stable')
+                sorted_values = values[order]
+                # NaNs sort last and must never match a range
+                valid = len(values) - int(np.isnan(sorted_values).sum()) if sorted_values.dtype.kind == 'f' else len(values)
+                self.sorted[column] = (order, sorted_values, valid)
+            elif series.nunique() <= max_bitmap_cardinality:
+                codes, uniques = pd.factorize(series)
+                self.bitmaps[column] = {value: np.packbits(codes == code) for code, value in enumerate(uniques)}
+
+    def empty_bitmap(self):
+        return np.zeros((self.rows + 7) // 8, dtype=np.uint8)
+
+    def bitmap_for(self, column, values, fold_case=False):
+        # OR of the bitmaps of the given values, None if column has none
+        bitmaps = self.bitmaps.get(column)
+        if bitmaps is None:
+            return None
+        if fold_case:
+            bitmaps = self.folded_bitmaps_for(column)
+        result = self.empty_bitmap()
+        for value in values:
+            bitmap = bitmaps.get(value)
+            if bitmap is not None:
+                result |= bitmap
+        return result
+
+    def folded_bitmaps_for(self, column):
+        if column not in self.folded_bitmaps:
+            folded = {}
+            for value, bitmap in self.bitmaps[column].items():
+                key = str(value).lower()
+                folded[key] = folded[key] | bitmap if key in folded else bitmap
+            self.folded_bitmaps[column] = folded
+        return self.folded_bitmaps[column]
+
+    def positions_for(self, column, lower=None, upper=None, values=None):
+        # Sorted row positions within the bounds ((value, inclusive) pairs)
+        # and, if given, equal to one of values. None if the column has no
+        # sorted index or too many rows match for the index to pay off
+        index = self.sorted.get(column)
+        if index is None:
+            return None
+        order, sorted_values, valid = index
+        if values is not None:
+            slices = [(np.searchsorted(sorted_values, value, 'left'), np.searchsorted(sorted_values, value, 'right')) for value in sorted(values)]
+        else:
+            start, end = 0, valid
+            if lower is not None:
+                start = np.searchsorted(sorted_values, lower[0], 'left' if lower[1] else 'right')
+            if upper is not None:
+                end = np.searchsorted(sorted_values, upper[0], 'right' if upper[1] else 'left')
+            slices = [(start, max(start, end))]
+        if sum(end - start for start, end in slices) > INDEX_SELECTIVITY * self.rows:
+            return None
+        return np.sort(np.concatenate([order[start:end] for start, end in slices]))
+
+def index_dataset(df, columns=None):
+    # Builds the indexes for df, call once at load time
+    key = id(df)
+    dataset_indexes[key] = DatasetIndex(df, columns)
+    weakref.finalize(df, dataset_indexes.pop, key, None)
+    return df
+
+def dataset_index(df):
+    return dataset_indexes.get(id(df))
+
+def bits_at(bitmap, positions):
+    # Bitmap bits at the given row positions, as booleans
+    return ((bitmap[positions >> 3] >> (7 - (positions & 7)).astype(np.uint8)) & 1) == 1
+
+def unpack(bitmap, rows):
+    return np.unpackbits(bitmap, count=rows).astype(bool)
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import uuid
+import numpy as np
+import pandas as pd
+from schemaregistry import read_columns
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Typed, compact loading of the CSV datasets. Each known dataset declares a
+# kind per column:
+#   uuid      dropped unless asked for, then 16 byte fixed size binary
+#   category  low cardinality text, stored as codes plus categories
+#   string    free text kept as strings
+#   int/float downcast to the smallest type that holds the values exactly,
+#             floats stay float64 unless float32 gives every value back
+# Only the columns a request needs are read when usecols is given. Datasets
+# without a declared schema are read as-is and compacted the same way, with
+# text columns of low cardinality turned into categories.
+#
+# The typed frame is also written once to an Arrow IPC file under
+# COLUMNAR_CACHE_DIR (when pyarrow is installed). Later loads memory map that
+# file instead of parsing the CSV text, and only the requested columns are
+# converted. Set DATASET_CACHE_DIR to an empty string to always read the CSV.
+
+DATASET_SCHEMAS = {
+    'streaming_viewership_data.csv': {
+        'User_ID': 'uuid',
+        'Session_ID': 'uuid',
+        'Device_ID': 'int',
+        'Video_ID': 'int',
+        'Duration_Watched': 'float',
+        'Genre': 'category',
+        'Country': 'category',
+        'Age': 'int',
+        'Gender': 'category',
+        'Subscription_Status': 'category',
+        'Ratings': 'int',
+        'Languages': 'category',
+        'Device_Type': 'category',
+        'Location': 'string',
+        'Playback_Quality': 'category',
+        'Interaction_Events': 'int',
+    },
+    'study_performance.csv': {
+        'gender': 'category',
+        'race_ethnicity': 'category',
+        'parental_level_of_education': 'category',
+        'lunch': 'category',
+        'test_preparation_course': 'category',
+        'math_score': 'int',
+        'reading_score': 'int',
+        'writing_score': 'int',
+    },
+}
+
+# For datasets without a schema: text columns with fewer distinct values than
+# this fraction of the rows become categories
+CATEGORY_CARDINALITY = 0.5
+
+COLUMNAR_CACHE_DIR = os.environ.get('DATASET_CACHE_DIR', '.dataset_cache')
+COLUMNAR_CACHE_VERSION = 2
+
+READ_DTYPES = {'category': 'category', 'string': 'str', 'uuid': 'str'}
+
+def schema_for(data_path):
+    return DATASET_SCHEMAS.get(os.path.basename(data_path))
+
+def request_columns(entities):
+    # Every column a parsed request refers to, for usecols or project_columns
+    columns = list(entities.get('columns') or [])
+    for condition in entities.get('conditions') or []:
+        columns.append(condition['column'])
+    for key in ('group_by', 'order_by'):
+        value = entities.get(key)
+        columns.extend(value if isinstance(value, (list, tuple)) else [value])
+    top_x = entities.get('top_x')
+    if top_x:
+        columns.append(top_x[1])
+    return [column for column in dict.fromkeys(columns) if column]
+
+def project_columns(df, columns):
+    # df cut down to columns (those it has), all of df without any
+    present = [column for column in columns if column in df.columns]
+    return df[present] if present else df
+
+def uuid_bytes(series):
+    # UUID strings as 16 bytes each, without the 36 character text
+    def to_bytes(value):
+        try:
+            return uuid.UUID(value).bytes
+        except (TypeError, ValueError, AttributeError):
+            return None
+    values = [to_bytes(value) for value in series]
+    if pa is None:
+        return pd.Series(values, index=series.index, dtype=object)
+    return pd.Series(pd.arrays.ArrowExtensionArray(pa.array(values, pa.binary(16))), index=series.index)
+
+def exact_float(series):
+    # float32 only when every value survives the round trip, sums and means
+    # over the column must not change with the storage type
+    values = pd.to_numeric(series).astype(np.float64)
+    narrow = values.astype(np.float32)
+    if np.array_equal(narrow.to_numpy(dtype=np.float64), values.to_numpy(), equal_nan=True):
+        return narrow
+    return values
+
+def downcast(series, kind):
+    if kind == 'int' and not series.isna().any():
+        return pd.to_numeric(series, downcast='integer')
+    # Floats, and ints with missing values (NaN needs a float)
+    return exact_float(series)
+
+def compact_column(series, kind):
+    if kind == 'uuid':
+        return uuid_bytes(series)
+    if kind in ('int', 'float'):
+        return downcast(series, kind)
+    return series
+
+def infer_kind(series):
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return 'int'
+    if pd.api.types.is_float_dtype(series.dtype):
+        return 'float'
+    if pd.api.types.is_string_dtype(series.dtype) or series.dtype == object:
+        if series.nunique() < CATEGORY_CARDINALITY * len(series):
+            return 'category'
+        return 'string'
+    return None
+
+def select_columns(data_path, available, schema, usecols, include_uuids):
+    if usecols is not None:
+        missing = [column for column in usecols if column not in available]
+        if missing:
+            print(f"Columns not in {data_path}, not loaded: {', '.join(missing)}")
+        return [column for column in available if column in usecols]
+    if schema is None or include_uuids:
+        return None
+    return [column for column in available if schema.get(column) != 'uuid']
+
+def read_csv_dataset(data_path, usecols=None, include_uuids=False):
+    schema = schema_for(data_path)
+    columns = select_columns(data_path, read_columns(data_path), schema, usecols, include_uuids)
+    if schema is not None:
+        dtypes = {column: READ_DTYPES[kind] for column, kind in schema.items() if kind in READ_DTYPES}
+        df = pd.read_csv(data_path, usecols=columns, dtype=dtypes)
+        kinds = schema
+    else:
+        df = pd.read_csv(data_path, usecols=columns)
+        kinds = {column: infer_kind(df[column]) for column in df.columns}
+        df = df.astype({column: 'category' for column, kind in kinds.items() if kind == 'category'})
+    for column in df.columns:
+        kind = kinds.get(column)
+        if kind in ('uuid', 'int', 'float'):
+            df[column] = compact_column(df[column], kind)
+    return df
+
+def columnar_cache_path(data_path):
+    # Keyed on the CSV's size and mtime and on its schema, so an edited file
+    # or schema gets a fresh conversion
+    stat = os.stat(data_path)
+    digest = hashlib.sha256(json.dumps([COLUMNAR_CACHE_VERSION, os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns, schema_for(data_path)], sort_keys=True).encode('utf-8'))
+    return os.path.join(COLUMNAR_CACHE_DIR, f"{os.path.basename(data_path)}.{digest.hexdigest()[:16]}.arrow")
+
+def write_columnar(df, cache_path):
+    os.makedirs(COLUMNAR_CACHE_DIR, exist_ok=True)
+    # Without the pandas metadata: the Arrow types alone give back the same
+    # dtypes, and the metadata's dtype names for the UUID columns cannot be
+    # parsed back when only some columns are selected
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    # Write then rename so a concurrent reader never sees half a file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        # Uncompressed, so the reload can map the buffers as they are
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, cache_path)
+
+def arrow_types(arrow_type):
+    # Keep the UUID bytes in Arrow instead of one Python bytes object per row
+    if pa.types.is_fixed_size_binary(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+def read_columnar(cache_path, data_path, usecols, include_uuids):
+    # The file is memory mapped and read without copying, only the selected
+    # columns are then converted and so paged in
+    table = pa.ipc.open_file(pa.memory_map(cache_path, 'r')).read_all()
+    columns = select_columns(data_path, table.column_names, schema_for(data_path), usecols, include_uuids)
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True, types_mapper=arrow_types)
+
+def load_dataset(data_path, usecols=None, include_uuids=False):
+    # usecols limits the load to those columns (UUID columns included if
+    # named), otherwise everything but the UUID columns is loaded unless
+    # include_uuids is set. The CSV is only parsed the first time, after that
+    # the columnar copy is used
+    if pa is None or not COLUMNAR_CACHE_DIR:
+        return read_csv_dataset(data_path, usecols, include_uuids)
+    cache_path = columnar_cache_path(data_path)
+    if not os.path.exists(cache_path):
+        try:
+            write_columnar(read_csv_dataset(data_path, include_uuids=True), cache_path)
+        except (OSError, pa.ArrowException) as e:
+            print(f"Could not write columnar copy of {data_path} to {cache_path}: {str(e)}")
+            return read_csv_dataset(data_path, usecols, include_uuids)
+    try:
+        return read_columnar(cache_path, data_path, usecols, include_uuids)
+    except (OSError, pa.ArrowException) as e:
+        print(f"Could not read columnar copy {cache_path}, reading the CSV: {str(e)}")
+        return read_csv_dataset(data_path, usecols, include_uuids)
+
+def memory_report(df):
+    # Bytes per column, for checking what a schema saves
+    return df.memory_usage(deep=True, index=False).to_dict()
+
+if __name__ == '__main__':
+    import sys
+    for path in sys.argv[1:] or ['streaming_viewership_data.csv']:
+        plain = pd.read_csv(path).memory_usage(deep=True).sum()
+        compact = load_dataset(path).memory_usage(deep=True).sum()
+        with_uuids = load_dataset(path, include_uuids=True).memory_usage(deep=True).sum()
+        print(f"{path}: {plain} bytes as-is, {compact} typed, {with_uuids} typed with UUIDs ({np.round(plain / compact, 1)}x)")
@@ -0,0 +1,130 @@
+import math
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.patches import Rectangle, Wedge
+from matplotlib.ticker import FixedFormatter
+from chartspecs import AGGREGATIONS, REDUCTIONS, CHART_SPECS
+
+# Reused figures for the chart types dashboards keep asking for. The first
+# render of a (chart type, columns) pair draws a fresh figure and keeps it,
+# with its canvas, as a template. Later renders with the same layout (same
+# number of bars, wedges or lines) only move the existing artists to the new
+# data (heights, wedge angles, line data, tick and label text) and redraw,
+# so no figure, axes, fonts, legends or titles are built again. Anything that
+# does not fit the template is drawn fresh and becomes the new template.
+# Each render pool worker has its own pool and renders one chart at a time.
+
+MAX_TEMPLATES = 32
+
+class FigureTemplate:
+    def __init__(self, fig, canvas, chart_type, columns):
+        self.fig = fig
+        self.canvas = canvas
+        self.ax = fig.axes[0]
+        self.chart_type = chart_type
+        self.columns = columns
+
+def aggregated(chart_type, df, columns):
+    return AGGREGATIONS[CHART_SPECS[chart_type].aggregation](df, columns, None, None, False)
+
+def update_bar(template, df):
+    # Same number of bars: new heights, tick labels and y range
+    ax = template.ax
+    means = aggregated('bar', df, template.columns)
+    containers = [container for container in ax.containers if all(isinstance(patch, Rectangle) for patch in container)]
+    if len(containers) != 1 or len(containers[0]) != len(means):
+        return False
+    for rect, height in zip(containers[0], means[template.columns[1]].to_numpy(dtype=np.float64)):
+        rect.set_height(height)
+    # The tick label styling (rotation, fonts) stays on the existing ticks
+    ax.xaxis.set_major_formatter(FixedFormatter([str(label) for label in means[template.columns[0]]]))
+    ax.relim()
+    ax.autoscale_view(scalex=False)
+    return True
+
+def update_pie(template, df):
+    # Same number of wedges: new angles, label and percentage texts
+    ax = template.ax
+    shares = aggregated('pie', df, template.columns)
+    values = shares.to_numpy(dtype=np.float64)
+    wedges = [patch for patch in ax.patches if isinstance(patch, Wedge)]
+    if len(wedges) != len(values) or not len(values) or (values < 0).any() or not values.sum() > 0:
+        return False
+    # Labels sit outside the wedges, percentages inside
+    labels = [text for text in ax.texts if math.hypot(*text.get_position()) > 1]
+    percents = [text for text in ax.texts if math.hypot(*text.get_position()) <= 1]
+    if len(labels) != len(wedges) or len(percents) != len(wedges):
+        return False
+    theta1 = wedges[0].theta1 / 360
+    for wedge, label, percent, value, name in zip(wedges, labels, percents, values / values.sum(), shares.index):
+        theta2 = theta1 + value
+        wedge.set_theta1(360 * theta1)
+        wedge.set_theta2(360 * theta2)
+        middle = np.pi * (theta1 + theta2)
+        x, y = math.cos(middle), math.sin(middle)
+        label.set_position((1.1 * x, 1.1 * y))
+        label.set_horizontalalignment('left' if x > 0 else 'right')
+        label.set_text(str(name))
+        percent.set_position((0.6 * x, 0.6 * y))
+        percent.set_text('%1.1f%%' % (100 * value))
+        theta1 = theta2
+    return True
+
+def update_line(template, df):
+    # Same line over a numeric x: new data and axis ranges
+    ax = template.ax
+    columns = template.columns
+    if len(ax.lines) != 1 or not pd.api.types.is_numeric_dtype(df[columns[0]].dtype):
+        return False
+    fig = template.fig
+    reduced = REDUCTIONS[CHART_SPECS['line'].reduction](df, columns, fig.get_size_inches(), fig.dpi)[0]
+    ax.lines[0].set_data(reduced[columns[0]].to_numpy(), reduced[columns[1]].to_numpy())
+    ax.relim()
+    ax.autoscale_view()
+    return True
+
+UPDATES = {
+    'bar': update_bar,
+    'pie': update_pie,
+    'line': update_line,
+}
+
+class FigurePool:
+    def __init__(self, draw, max_templates=MAX_TEMPLATES):
+        # draw(df, chart_type, dpi) -> a fresh Figure or None
+        self.draw = draw
+        self.max_templates = max_templates
+        self.templates = OrderedDict()  # (chart type, columns) -> FigureTemplate
+        self.hits = 0
+        self.misses = 0
+
+    def figure(self, df, chart_type, dpi):
+        # The chart as a Figure with an Agg canvas, not drawn yet, None if it
+        # cannot be drawn
+        key = (chart_type, tuple(df.columns))
+        template = self.templates.pop(key, None)
+        if template is not None:
+            template.fig.set_dpi(dpi)
+            if self.update(template, df):
+                self.templates[key] = template
+                self.hits += 1
+                return template.fig
+        self.misses += 1
+        fig = self.draw(df, chart_type, dpi)
+        if fig is None:
+            return None
+        canvas = FigureCanvasAgg(fig)
+        if chart_type in UPDATES:
+            self.templates[key] = FigureTemplate(fig, canvas, chart_type, list(df.columns))
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return fig
+
+    def update(self, template, df):
+        try:
+            return UPDATES[template.chart_type](template, df)
+        except (KeyError, TypeError, ValueError):
+            # Possibly left half updated, it is replaced by a fresh figure
+            return False
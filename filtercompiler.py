@@ -0,0 +1,270 @@
+import weakref
+import numpy as np
+import pandas as pd
+from datasetindex import dataset_index, bits_at, unpack
+
+# Compiles the parsed condition lists of the NL chart scripts
+# ({'column', 'operator', 'value'} dicts) into one boolean mask. Conditions on
+# the same column are merged into a single range first ('age > 20' and
+# 'age > 30' and 'age < 50' become 30 < age < 50), each column is then
+# compared once over its numpy array and the results are and-ed into the mask
+# in place, so the only DataFrame built is the final df[mask].
+#
+# For case-insensitive equality and IN filters, fold_text_columns keeps a
+# companion per text column, built once when the dataset is loaded: the
+# lowercased column factorized into integer codes plus a value -> code dict.
+# 'genre = comedy' is then a dict lookup and an integer comparison instead of
+# lowercasing the whole column on every request.
+#
+# When the dataset also has a datasetindex.DatasetIndex, conditions it can
+# answer are taken from the bitmaps and sorted indexes first, and a selective
+# index hit restricts all remaining comparisons to the candidate rows.
+
+OPERATORS = {
+    '>': '>', 'greater': '>', 'greater than': '>', 'more': '>', 'more than': '>',
+    'older': '>', 'older than': '>', 'above': '>',
+    '<': '<', 'less': '<', 'less than': '<', 'younger': '<', 'younger than': '<', 'below': '<',
+    '>=': '>=', '<=': '<=',
+    '=': '=', '==': '=', 'equal': '=', 'equals': '=',
+    'in': 'in',
+}
+
+# Text columns with more distinct values than this fraction of the rows (ids,
+# free text) are not folded, an equality there is as cheap as the codes
+MAX_FOLDED_CARDINALITY = 0.5
+
+folded_frames = {}  # id(df) -> {column: FoldedColumn}
+
+def normalize_operator(operator):
+    return OPERATORS.get(str(operator).strip().lower())
+
+def is_text_dtype(dtype):
+    return dtype == object or pd.api.types.is_string_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype)
+
+def coerce_value(value, dtype, fold_case):
+    # Text columns compare as strings, everything else as floats
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return frozenset(coerce_value(item, dtype, fold_case) for item in value)
+    if is_text_dtype(dtype):
+        value = str(value)
+        return value.lower() if fold_case else value
+    return float(value)
+
+class FoldedColumn:
+    def __init__(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Only the categories need lowercasing, the row codes are remapped
+            category_codes, uniques = pd.factorize(series.cat.categories.str.lower())
+            codes = series.cat.codes.to_numpy()
+            self.codes = np.where(codes >= 0, category_codes[codes], -1)
+        else:
+            self.codes, uniques = pd.factorize(series.str.lower())
+        self.codes = self.codes.astype(np.int32 if len(uniques) < 2 ** 31 else np.int64)
+        self.code_for = {value: code for code, value in enumerate(uniques)}
+
+    def equality_mask(self, values, mask, positions=None):
+        codes = [self.code_for[value] for value in values if value in self.code_for]
+        row_codes = self.codes if positions is None else self.codes[positions]
+        if not codes:
+            mask[:] = False
+        elif len(codes) == 1:
+            mask &= row_codes == codes[0]
+        else:
+            mask &= np.isin(row_codes, codes)
+
+def fold_text_columns(df):
+    # Builds the case-folded companions for df, call once at load time
+    folded = {}
+    for column in df.columns:
+        series = df[column]
+        if not is_text_dtype(series.dtype):
+            continue
+        if series.nunique() > MAX_FOLDED_CARDINALITY * len(series):
+            continue
+        folded[column] = FoldedColumn(series)
+    key = id(df)
+    folded_frames[key] = folded
+    weakref.finalize(df, folded_frames.pop, key, None)
+    return df
+
+def folded_column(df, column):
+    return folded_frames.get(id(df), {}).get(column)
+
+class ColumnRange:
+    def __init__(self, column):
+        self.column = column
+        self.lower = None  # (value, inclusive)
+        self.upper = None
+        self.values = None  # allowed values from = and IN, intersected
+
+    def add(self, operator, value):
+        if operator in ('=', 'in'):
+            values = value if isinstance(value, frozenset) else frozenset([value])
+            self.values = values if self.values is None else self.values & values
+        elif operator in ('>', '>='):
+            inclusive = operator == '>='
+            if self.lower is None or value > self.lower[0] or (value == self.lower[0] and not inclusive):
+                self.lower = (value, inclusive)
+        else:
+            inclusive = operator == '<='
+            if self.upper is None or value < self.upper[0] or (value == self.upper[0] and not inclusive):
+                self.upper = (value, inclusive)
+
+    def contains(self, value):
+        if self.lower is not None:
+            bound, inclusive = self.lower
+            if value < bound or (value == bound and not inclusive):
+                return False
+        if self.upper is not None:
+            bound, inclusive = self.upper
+            if value > bound or (value == bound and not inclusive):
+                return False
+        return True
+
+    def is_empty(self):
+        # Decided from the bounds alone, without looking at any rows
+        if self.values is not None:
+            return not any(self.contains(value) for value in self.values)
+        if self.lower is not None and self.upper is not None:
+            (low, low_inclusive), (high, high_inclusive) = self.lower, self.upper
+            return low > high or (low == high and not (low_inclusive and high_inclusive))
+        return False
+
+    def allowed_values(self):
+        # Bounds next to an equality or IN only narrow the allowed values
+        return [value for value in self.values if self.contains(value)]
+
+    def apply(self, values, mask):
+        # and-s this column's condition into mask in place
+        if self.is_empty():
+            mask[:] = False
+            return
+        if self.values is not None:
+            allowed = self.allowed_values()
+            if len(allowed) == 1:
+                mask &= values == allowed[0]
+            else:
+                mask &= np.isin(values, allowed)
+            return
+        if self.lower is not None:
+            bound, inclusive = self.lower
+            mask &= values >= bound if inclusive else values > bound
+        if self.upper is not None:
+            bound, inclusive = self.upper
+            mask &= values <= bound if inclusive else values < bound
+
+    def __repr__(self):
+        return f"ColumnRange({self.column!r}, lower={self.lower}, upper={self.upper}, values={self.values!r})"
+
+def compile_filter(conditions, dtypes, fold_case=False):
+    # Returns one ColumnRange per filtered column, in first appearance order
+    ranges = {}
+    for condition in conditions or []:
+        column = condition['column']
+        operator = normalize_operator(condition['operator'])
+        value = condition['value']
+        if column is None or value is None:
+            continue
+        if operator is None:
+            print(f"Unknown operator '{condition['operator']}' for column '{column}'. Skipping filter.")
+            continue
+        if column not in dtypes:
+            print(f"Column '{column}' not found in data. Skipping filter.")
+            continue
+        try:
+            value = coerce_value(value, dtypes[column], fold_case)
+        except (TypeError, ValueError):
+            print(f"Unable to convert value '{value}' to float for column '{column}'. Skipping filter.")
+            continue
+        if column not in ranges:
+            ranges[column] = ColumnRange(column)
+        try:
+            ranges[column].add(operator, value)
+        except TypeError:
+            print(f"Cannot compare '{value}' with the other conditions on column '{column}'. Skipping filter.")
+    return list(ranges.values())
+
+def column_values(df, column, fold_case, positions=None):
+    series = df[column] if positions is None else df[column].iloc[positions]
+    if fold_case and is_text_dtype(series.dtype):
+        series = series.str.lower()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    return series.to_numpy()
+
+def scan_range(df, column_range, fold_case, mask, positions=None):
+    # and-s one column's condition into mask by looking at the column, only
+    # at the given row positions if there are any
+    folded = folded_column(df, column_range.column) if fold_case else None
+    if folded is not None and column_range.values is not None:
+        folded.equality_mask(column_range.allowed_values(), mask, positions)
+        return
+    column_range.apply(column_values(df, column_range.column, fold_case, positions), mask)
+
+def index_lookup(index, column_range, fold_case):
+    # ('bitmap', packed bits) or ('positions', sorted rows) from the dataset
+    # index, None if it cannot answer this condition
+    values = column_range.allowed_values() if column_range.values is not None else None
+    if values is not None:
+        bitmap = index.bitmap_for(column_range.column, values, fold_case)
+        if bitmap is not None:
+            return 'bitmap', bitmap
+    positions = index.positions_for(column_range.column, column_range.lower, column_range.upper, values)
+    if positions is not None:
+        return 'positions', positions
+    return None
+
+def filter_rows(df, conditions, fold_case=False):
+    # Either a boolean mask over df or, when a selective sorted index lookup
+    # narrowed things down, the sorted positions of the matching rows
+    ranges = compile_filter(conditions, df.dtypes, fold_case)
+    if any(column_range.is_empty() for column_range in ranges):
+        return np.zeros(len(df), dtype=bool)
+
+    index = dataset_index(df)
+    bitmap = None
+    positions = None
+    remaining = []
+    for column_range in ranges:
+        found = index_lookup(index, column_range, fold_case) if index is not None else None
+        if found is None:
+            remaining.append(column_range)
+        elif found[0] == 'bitmap':
+            bitmap = found[1] if bitmap is None else bitmap & found[1]
+        else:
+            positions = found[1] if positions is None else np.intersect1d(positions, found[1], assume_unique=True)
+
+    if positions is not None:
+        # Only the candidate rows are looked at from here on
+        if bitmap is not None:
+            positions = positions[bits_at(bitmap, positions)]
+        for column_range in remaining:
+            keep = np.ones(len(positions), dtype=bool)
+            scan_range(df, column_range, fold_case, keep, positions)
+            positions = positions[keep]
+        return positions
+
+    mask = unpack(bitmap, len(df)) if bitmap is not None else np.ones(len(df), dtype=bool)
+    for column_range in remaining:
+        scan_range(df, column_range, fold_case, mask)
+    return mask
+
+def filter_mask(df, conditions, fold_case=False):
+    rows = filter_rows(df, conditions, fold_case)
+    if rows.dtype == bool:
+        return rows
+    mask = np.zeros(len(df), dtype=bool)
+    mask[rows] = True
+    return mask
+
+def apply_filter(df, conditions, fold_case=False):
+    # fold_case compares text columns lowercased, for parsers that lowercase
+    # the request and therefore the values
+    if not conditions:
+        return df
+    rows = filter_rows(df, conditions, fold_case)
+    if rows.dtype != bool:
+        return df.iloc[rows]
+    if rows.all():
+        return df
+    return df[rows]
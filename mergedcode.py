@@ -1,19 +1,41 @@
-import spacy
-import pandas as pd
 import re
+from functools import lru_cache
+from schemaregistry import get_alias_index
+from nlpfallback import resolve_chart_type
+from datasetloader import load_dataset, project_columns, request_columns, schema_for
+from filtercompiler import apply_filter, fold_text_columns
+from datasetindex import index_dataset
+from aggcubes import AggregateCubes, group_aggregate
+from chartspecs import CHART_SPECS, ChartSpecError, validate_chart, render_chart
 import matplotlib.pyplot as plt
-import seaborn as sns
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")
-
-# Read data from CSV file (replace with your data file)
-df = pd.read_csv('streaming_viewership_data.csv')
+# Data file (replace with your data file)
+DATA_PATH = 'streaming_viewership_data.csv'
+
+@lru_cache(maxsize=None)
+def load_data():
+    # Read the data file once, with the case-folded text columns and the
+    # indexes the filters use, so those are built once; requests filter this
+    # frame and then keep only the columns they refer to
+    return index_dataset(fold_text_columns(load_dataset(DATA_PATH)))
+
+@lru_cache(maxsize=None)
+def load_cubes():
+    # Group-by aggregates of the whole dataset, answer the group by charts
+    # when the request only filters on low cardinality columns
+    return AggregateCubes(load_data())
+
+def cubes_for(chart_type, group_by):
+    # The cubes read the whole dataset, only built for the charts that
+    # aggregate it, other requests stay on the columns they name
+    if group_by or CHART_SPECS[chart_type].aggregation:
+        return load_cubes()
+    return None
 
 # Generate dynamic column aliases
-def generate_column_aliases(df):
+def generate_column_aliases(columns):
     column_aliases = {}
-    for col in df.columns:
+    for col in columns:
         col_variations = [col, col.lower(), col.replace("_", " "), col.replace("_", "").lower()]
         col_variations += [re.sub(r'\W+', '', col).lower()]
         col_variations = list(set(col_variations))
@@ -21,24 +43,22 @@ def generate_column_aliases(df):
             column_aliases[variation] = col
     return column_aliases
 
-column_aliases = generate_column_aliases(df)
+def column_alias_index():
+    # Built from the CSV header only and cached on disk per schema
+    return get_alias_index(DATA_PATH, generate_column_aliases)
 
 
-def parse_user_request(request, df, column_aliases):
+def parse_user_request(request, alias_index):
     entities = {'chart_type': None, 'columns': [], 'conditions': [], 'group_by': None, 'order_by': None}
     request_lower = request.lower()
 
     # Extract chart type
     chart_types = ['pie', 'bar', 'histogram', 'line', 'area', 'scatter', 'box', 'heatmap', 'violin', 'bubble']
-    chart_type_pattern = r'\b(' + '|'.join(chart_types) + r')\b'
-    chart_type_match = re.search(chart_type_pattern, request_lower)
-    if chart_type_match:
-        entities['chart_type'] = chart_type_match.group(1)
+    # Regex first, spaCy is only loaded if that finds nothing
+    entities['chart_type'] = resolve_chart_type(request_lower, chart_types)
 
     # Extract columns
-    for alias, actual_col in column_aliases.items():
-        if alias in request_lower and actual_col not in entities['columns']:
-            entities['columns'].append(actual_col)
+    entities['columns'] = alias_index.columns_in(request_lower)
 
     # Extract conditions using regex
     condition_extraction_pattern = r"(\w+)\s*(=|>|<|>=|<=|equals|greater than|less than|above|below|more than|older than|younger than)\s*'*(\w+\.?\w*)'*"
@@ -48,11 +68,7 @@ def parse_user_request(request, df, column_aliases):
         operator_text = match[1].strip().lower()
         value = match[2].strip()
 
-        condition_col = None
-        for alias, actual_col in column_aliases.items():
-            if alias == condition_col_text:
-                condition_col = actual_col
-                break
+        condition_col = alias_index.lookup(condition_col_text)
 
         if condition_col:
             if operator_text in ['=', 'equals', 'equal']:
@@ -72,96 +88,49 @@ def parse_user_request(request, df, column_aliases):
     group_by_match = re.search(group_by_pattern, request_lower)
     if group_by_match:
         group_by_col = group_by_match.group(1).strip().lower()
-        for alias, actual_col in column_aliases.items():
-            if alias == group_by_col:
-                entities['group_by'] = actual_col
-                break
+        entities['group_by'] = alias_index.lookup(group_by_col)
 
     # Extract order by
     order_by_pattern = r'order\s+by\s+(\w+)'
     order_by_match = re.search(order_by_pattern, request_lower)
     if order_by_match:
         order_by_col = order_by_match.group(1).strip().lower()
-        for alias, actual_col in column_aliases.items():
-            if alias == order_by_col:
-                entities['order_by'] = actual_col
-                break
+        entities['order_by'] = alias_index.lookup(order_by_col)
 
     return entities
 def filter_data(df, conditions):
-    filtered_df = df.copy()
-    if conditions:
-        for condition in conditions:
-            filter_col = condition['column']
-            operator = condition['operator']
-            value = condition['value']
-            if df[filter_col].dtype == 'O':
-                value = str(value)
-            else:
-                try:
-                    value = float(value)
-                except ValueError:
-                    print(f"Unable to convert value '{value}' to float for column '{filter_col}'. Skipping filter.")
-                    continue
-            if operator == '=':
-                filtered_df = filtered_df[filtered_df[filter_col].str.lower() == value]
-            elif operator == '>':
-                filtered_df = filtered_df[filtered_df[filter_col] > value]
-            elif operator == '<':
-                filtered_df = filtered_df[filtered_df[filter_col] < value]
-            elif operator == '>=':
-                filtered_df = filtered_df[filtered_df[filter_col] >= value]
-            elif operator == '<=':
-                filtered_df = filtered_df[filtered_df[filter_col] <= value]
-    return filtered_df
-
-def generate_chart(df, chart_type, columns, group_by=None, order_by=None):
-    plt.figure(figsize=(10, 6))
-    
+    # Values are lowercased by the parser, so text columns compare lowercased
+    return apply_filter(df, conditions, fold_case=True)
+
+def chart_columns(chart_type, columns, group_by=None):
+    # The columns the chart is drawn from: a pie with a group by shares the
+    # column's sum out per group
+    if chart_type == 'pie' and group_by:
+        return [group_by] + list(columns[:1])
+    return list(columns)
+
+def generate_chart(df, chart_type, columns, group_by=None, order_by=None, cubes=None, conditions=None):
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
+        print(f"Chart type '{chart_type}' is not supported.")
+        return
+
     if order_by and order_by in df.columns:
         df = df.sort_values(by=order_by)
-    
-    if chart_type == 'bar':
-        sns.barplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} by {columns[0].capitalize()}')
-        # Group by if group_by column is specified
-        if group_by and group_by in df.columns:
-            numeric_columns = df.select_dtypes(include='number').columns.tolist()
-            df = df.groupby(group_by)[numeric_columns].sum().reset_index()  # Aggregate numeric columns by sum
-        
-        if chart_type == 'pie':
-            if len(columns) == 1 and group_by:  # Ensure we have one column for the pie and a valid group_by column
-                if group_by in df.columns and columns[0] in df.columns:
-                    pie_data = df.groupby(group_by)[columns[0]].sum()
-                    plt.pie(pie_data, labels=pie_data.index, autopct='%1.1f%%', startangle=140)
-                    plt.title(f'Pie Chart of {columns[0].capitalize()} by {group_by.capitalize()}')
-                else:
-                    print(f"Group by column '{group_by}' or pie chart column '{columns[0]}' not found in DataFrame.")
-            else:
-                print("Invalid columns provided for pie chart.")
-        else:
-            print(f"Chart type '{chart_type}' is not supported for this request.")
-        
-   
-    elif chart_type == 'line':
-        sns.lineplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'Line Chart of {columns[1].capitalize()} over {columns[0].capitalize()}')
-    elif chart_type == 'scatter':
-        sns.scatterplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'Scatter Plot of {columns[1].capitalize()} vs {columns[0].capitalize()}')
-    elif chart_type == 'histogram':
-        plt.hist(df[columns[0]], bins=10)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel('Frequency')
-        plt.title(f'Histogram of {columns[0].capitalize()}')
-    else:
-        print(f"Chart type '{chart_type}' is not supported.")
+
+    # Group by if group_by column is specified
+    if chart_type == 'bar' and group_by and group_by in df.columns:
+        numeric_columns = df.select_dtypes(include='number').columns.tolist()
+        df = group_aggregate(df, group_by, 'sum', numeric_columns, cubes, conditions, fold_case=True, sort=False).reset_index()  # Aggregate numeric columns by sum
+        cubes = None  # df is aggregated from here on
+
+    fig = plt.figure(figsize=spec.figsize)
+    try:
+        render_chart(fig, chart_type, df, chart_columns(chart_type, columns, group_by), cubes, conditions, fold_case=True)
+    except ChartSpecError as e:
+        print(f"Cannot draw this chart: {e}")
+        plt.close(fig)
+        return
 
     plt.tight_layout()
     plt.show()
@@ -173,7 +142,7 @@ def main():
             print("Exiting program...")
             break
         
-        parsed_request = parse_user_request(user_input, df, column_aliases)
+        parsed_request = parse_user_request(user_input, column_alias_index())
         print("\nParsed Request:")
         print(parsed_request)
         
@@ -183,12 +152,20 @@ def main():
         group_by = parsed_request['group_by']
         order_by = parsed_request['order_by']
 
-        filtered_df = filter_data(df, conditions)
+        try:
+            # Nothing is loaded for a chart the columns cannot give
+            validate_chart(chart_type, chart_columns(chart_type, columns, group_by), schema_for(DATA_PATH))
+        except ChartSpecError as e:
+            print(f"Cannot draw this chart: {e}")
+            continue
+
+        # Filtered with the dataset's indexes, then cut to the request's columns
+        filtered_df = project_columns(filter_data(load_data(), conditions), request_columns(parsed_request))
 
         print(f"\nFiltered DataFrame:\n{filtered_df.head()}\n")
 
         if not filtered_df.empty:
-            generate_chart(filtered_df, chart_type, columns, group_by, order_by)
+            generate_chart(filtered_df, chart_type, columns, group_by, order_by, cubes_for(chart_type, group_by), conditions)
         else:
             print("No data available after filtering. Skipping chart generation.")
 
@@ -0,0 +1,70 @@
+import re
+from functools import lru_cache
+
+# Chart type detection for the NL chart scripts. The fast path (a chart type
+# word, else a plural or a word glued to 'chart'/'plot'/'graph') resolves
+# almost every request; spaCy is only imported and loaded the first time a
+# request gets past it, to match on lemmas, batched through nlp.pipe. Without
+# spaCy or its model such requests simply get no chart type.
+
+CHART_TYPES = ['pie', 'bar', 'histogram', 'line', 'area', 'scatter', 'box', 'heatmap', 'violin', 'bubble', 'table']
+SPACY_MODEL = "en_core_web_sm"
+# Only the lemmas are used, which need the tagger but not the parser or NER
+UNUSED_COMPONENTS = ["parser", "senter", "ner"]
+NLP_BATCH_SIZE = 64
+
+CHART_TYPE_PATTERN = re.compile(r'\b(' + '|'.join(CHART_TYPES) + r')\b', re.IGNORECASE)
+WORD_PATTERN = re.compile(r'\w+')
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    # None (said once) when spaCy or its model is not installed
+    try:
+        import spacy
+        print(f"Loading spaCy model {SPACY_MODEL} for requests the fast parser could not resolve")
+        return spacy.load(SPACY_MODEL, exclude=UNUSED_COMPONENTS)
+    except (ImportError, OSError) as e:
+        print(f"spaCy model {SPACY_MODEL} not available, requests without a chart type word get none: {str(e)}")
+        return None
+
+def chart_type_from_token(text, chart_types):
+    # Chart type of one word, also plurals ('bars') and words glued to
+    # 'chart'/'plot'/'graph' ('piechart', 'scatterplot')
+    text = text.lower()
+    for candidate in (text, text[:-1] if text.endswith('s') else None):
+        if candidate in chart_types:
+            return candidate
+    for suffix in ('chart', 'charts', 'plot', 'plots', 'graph', 'graphs'):
+        if text.endswith(suffix) and text[:-len(suffix)] in chart_types:
+            return text[:-len(suffix)]
+    return None
+
+def find_chart_type(request, chart_types=CHART_TYPES):
+    # Fast path: first chart type word in the request, else the first word
+    # that is one in another form
+    for match in CHART_TYPE_PATTERN.finditer(request):
+        chart_type = match.group(1).lower()
+        if chart_type in chart_types:
+            return chart_type
+    for word in WORD_PATTERN.findall(request):
+        chart_type = chart_type_from_token(word, chart_types)
+        if chart_type:
+            return chart_type
+    return None
+
+def resolve_chart_types(requests, chart_types=CHART_TYPES):
+    results = [find_chart_type(request, chart_types) for request in requests]
+    unresolved = [i for i, chart_type in enumerate(results) if chart_type is None]
+    nlp = get_nlp() if unresolved else None
+    if nlp is not None:
+        docs = nlp.pipe((requests[i] for i in unresolved), batch_size=NLP_BATCH_SIZE)
+        for i, doc in zip(unresolved, docs):
+            for token in doc:
+                chart_type = chart_type_from_token(token.lemma_, chart_types)
+                if chart_type:
+                    results[i] = chart_type
+                    break
+    return results
+
+def resolve_chart_type(request, chart_types=CHART_TYPES):
+    return resolve_chart_types([request], chart_types)[0]
@@ -0,0 +1,62 @@
+from dataclasses import dataclass
+from requestdsl import QuerySyntaxError
+
+# What a chart request gets back, negotiated with the 'format' field of the
+# WebSocket request: either a name ("png", "svg", "json") or an object such
+# as {"type": "png", "dpi": 72, "compression": 1}.
+#   png   rasterized by Agg, at dpi and with the given zlib level (0-9,
+#         lower is faster and bigger)
+#   svg   vector output, no rasterization on the server
+#   json  no drawing at all: the chart type and the aggregated, reduced data
+#         the chart would be drawn from, for the client to draw itself
+# Without a format the answer is the PNG it always was.
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'json': 'application/json',
+}
+
+DEFAULT_DPI = 100
+MIN_DPI = 20
+MAX_DPI = 300
+DEFAULT_COMPRESSION = 6
+
+@dataclass(frozen=True)
+class OutputFormat:
+    kind: str = 'png'
+    dpi: int = DEFAULT_DPI
+    compression: int = DEFAULT_COMPRESSION
+
+    @property
+    def content_type(self):
+        return CONTENT_TYPES[self.kind]
+
+PNG = OutputFormat()
+
+def bounded_int(spec, name, default, low, high):
+    value = spec.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise QuerySyntaxError(f"Format {name} must be an integer from {low} to {high}")
+    return value
+
+def parse_output_format(spec):
+    # OutputFormat of a request's 'format' field, raises QuerySyntaxError
+    if spec is None:
+        return PNG
+    if isinstance(spec, str):
+        spec = {'type': spec}
+    if not isinstance(spec, dict):
+        raise QuerySyntaxError("Format must be a name or an object")
+    kind = spec.get('type', 'png')
+    if kind not in CONTENT_TYPES:
+        raise QuerySyntaxError(f"Format '{kind}' not supported, use one of {', '.join(CONTENT_TYPES)}")
+    unknown = set(spec) - {'type', 'dpi', 'compression'}
+    if unknown:
+        raise QuerySyntaxError(f"Unknown format option {', '.join(sorted(unknown))}")
+    # Only PNG has pixels and a compression level, the other formats ignore
+    # them so they don't split the chart cache
+    if kind != 'png':
+        return OutputFormat(kind)
+    return OutputFormat(kind, bounded_int(spec, 'dpi', DEFAULT_DPI, MIN_DPI, MAX_DPI),
+                        bounded_int(spec, 'compression', DEFAULT_COMPRESSION, 0, 9))
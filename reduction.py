@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# Reduction stage between the data and matplotlib, sized to what the figure
+# can show. A line never needs more points than the plot is pixels wide, a
+# scatter of a million points is a solid blob and a table of a million rows
+# is not readable, yet all of them cost render time linear in the rows.
+#   - lines: LTTB (largest triangle three buckets) picks the rows that keep
+#     the visual shape, min-max keeps each bucket's extremes for filled areas
+#   - scatter: past SCATTER_MAX_POINTS the points are counted on a grid of
+#     GRID_CELL_PIXELS cells and drawn as a heatmap
+#   - tables: the first MAX_TABLE_ROWS rows plus a note saying what was left
+# The reductions are linear in the rows and what is drawn is bounded, so
+# render time stays flat however large the input gets.
+
+SCATTER_MAX_POINTS = 5000
+GRID_CELL_PIXELS = 5
+MAX_TABLE_ROWS = 50
+
+def pixel_size(figsize, dpi=100):
+    # (width, height) of the figure in pixels
+    return int(figsize[0] * dpi), int(figsize[1] * dpi)
+
+def numeric_positions(values):
+    # Values to do arithmetic on: the values themselves when numeric,
+    # otherwise their positions (categorical or text x axes)
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series.to_numpy().astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return np.arange(len(series), dtype=np.float64)
+
+def lttb_indices(x, y, threshold):
+    # Positions of the threshold points LTTB keeps, first and last included
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    # Bucket i covers [edges[i], edges[i + 1]), the last edge is the last point
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        # Twice the triangle area between the last kept point, each candidate
+        # and the next bucket's average
+        area = np.abs((x[selected] - average_x) * (y[start:end] - y[selected])
+                      - (x[selected] - x[start:end]) * (average_y - y[selected]))
+        selected = start + int(np.argmax(area))
+        indices[i + 1] = selected
+    return indices
+
+def minmax_indices(y, buckets):
+    # Positions of each bucket's minimum and maximum, in order
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    whole = n // size * size
+    chunks = y[:whole].reshape(-1, size)
+    offsets = np.arange(len(chunks)) * size
+    picked = [offsets + chunks.argmin(axis=1), offsets + chunks.argmax(axis=1), [0, n - 1]]
+    if whole < n:
+        tail = y[whole:]
+        picked.append([whole + int(tail.argmin()), whole + int(tail.argmax())])
+    return np.unique(np.concatenate(picked))
+
+def reduce_line(df, x_column, y_columns, max_points, method='lttb'):
+    # The rows of df worth drawing as a line of at most about max_points
+    # points per y column, all y columns share the x axis so their picks are
+    # merged
+    if len(df) <= max_points:
+        return df
+    x = numeric_positions(df[x_column]) if x_column is not None else np.arange(len(df), dtype=np.float64)
+    picked = []
+    for column in y_columns:
+        y = numeric_positions(df[column])
+        valid = np.flatnonzero(~np.isnan(y) & ~np.isnan(x))
+        if method == 'minmax':
+            positions = minmax_indices(y[valid], max(1, max_points // 2))
+        else:
+            positions = lttb_indices(x[valid], y[valid], max_points)
+        picked.append(valid[positions])
+    if not picked:
+        return df
+    return df.iloc[np.unique(np.concatenate(picked))]
+
+def grid_bins(x, y, figsize, dpi=100, weights=None):
+    # Counts (or summed weights) on a grid of GRID_CELL_PIXELS pixel cells:
+    # (grid, x edges, y edges), grid indexed [y, x] as pcolormesh wants it
+    width, height = pixel_size(figsize, dpi)
+    x = numeric_positions(x)
+    y = numeric_positions(y)
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    if weights is not None:
+        weights = numeric_positions(weights)
+        valid &= ~np.isnan(weights)
+        weights = weights[valid]
+    bins = (max(1, width // GRID_CELL_PIXELS), max(1, height // GRID_CELL_PIXELS))
+    grid, x_edges, y_edges = np.histogram2d(x[valid], y[valid], bins=bins, weights=weights)
+    # Empty cells are left blank rather than drawn in the lowest color
+    return np.ma.masked_equal(grid.T, 0), x_edges, y_edges
+
+def sample_rows(df, max_rows):
+    # Evenly spaced rows, for plots that cannot be binned (e.g. colored by a
+    # third column)
+    if len(df) <= max_rows:
+        return df
+    return df.iloc[np.linspace(0, len(df) - 1, max_rows).astype(np.int64)]
+
+def truncate_table(df, max_rows=MAX_TABLE_ROWS):
+    # (first max_rows rows, note about the rest or None)
+    if len(df) <= max_rows:
+        return df, None
+    return df.head(max_rows), f"Showing {max_rows} of {len(df)} rows"
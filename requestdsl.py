@@ -0,0 +1,262 @@
+import re
+import time
+import dataclasses
+from dataclasses import dataclass
+from datetime import datetime
+
+# Parser for the chart request DSL shared by server.py and requestparser.py,
+# e.g. 'sum bytesFromClient+bytesFromServer group by appName order by value
+# chart pie order descending limit 5'. The request is tokenized in one pass
+# and each keyword dispatches to its clause parser, so parsing is linear in
+# the request length. The resulting Query is immutable and hashable, so it is
+# also used as a cache key.
+
+class QuerySyntaxError(ValueError):
+    pass
+
+@dataclass(frozen=True)
+class SumClause:
+    fields: tuple
+
+@dataclass(frozen=True)
+class GroupClause:
+    column: str
+
+@dataclass(frozen=True)
+class OrderClause:
+    column: str = None
+    direction: str = None  # 'ascending' or 'descending'
+
+@dataclass(frozen=True)
+class FilterClause:
+    column: str
+    values: tuple
+
+@dataclass(frozen=True)
+class TimeClause:
+    start: int = None  # epoch seconds
+    end: int = None
+
+@dataclass(frozen=True)
+class ChartClause:
+    chart_type: str
+
+@dataclass(frozen=True)
+class LimitClause:
+    count: int
+
+@dataclass(frozen=True)
+class Query:
+    sum: SumClause = None
+    group: GroupClause = None
+    order: OrderClause = None
+    filter: FilterClause = None
+    time: TimeClause = None
+    chart: ChartClause = None
+    limit: LimitClause = None
+
+    @property
+    def chart_type(self):
+        return self.chart.chart_type if self.chart else None
+
+    def data_key(self):
+        # Everything that changes the upstream data, i.e. all but the chart type
+        return dataclasses.replace(self, chart=None)
+
+KEYWORDS = {'sum', 'group', 'order', 'filter', 'start', 'end', 'chart', 'limit', 'ascending', 'descending'}
+DIRECTIONS = {'ascending', 'descending'}
+TOKEN_PATTERN = re.compile(r'\S+')
+
+def parse_date_to_epoch(date_str):
+    # Convert date string in dd/mm/yyyy format to epoch timestamp
+    dt = datetime.strptime(date_str, "%d/%m/%Y")
+    epoch_time = int(time.mktime(dt.timetuple()))
+    return epoch_time
+
+def tokenize(request):
+    return [match.group(0) for match in TOKEN_PATTERN.finditer(request)]
+
+class QueryParser:
+    def __init__(self, request):
+        self.tokens = tokenize(request)
+        self.lowered = [token.lower() for token in self.tokens]
+        self.pos = 0
+        self.clauses = {}
+
+    def peek(self):
+        return self.lowered[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self, what):
+        if self.pos >= len(self.tokens):
+            raise QuerySyntaxError(f"Expected {what} at end of request")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, keyword):
+        token = self.take(f"'{keyword}'")
+        if token.lower() != keyword:
+            raise QuerySyntaxError(f"Expected '{keyword}' but got '{token}'")
+
+    def set_clause(self, name, clause):
+        if name in self.clauses:
+            raise QuerySyntaxError(f"Duplicate {name} clause")
+        self.clauses[name] = clause
+
+    def parse(self):
+        handlers = {
+            'sum': self.parse_sum,
+            'group': self.parse_group,
+            'order': self.parse_order,
+            'ascending': self.parse_direction,
+            'descending': self.parse_direction,
+            'filter': self.parse_filter,
+            'start': self.parse_time,
+            'end': self.parse_time,
+            'chart': self.parse_chart,
+            'limit': self.parse_limit,
+        }
+        while self.pos < len(self.tokens):
+            keyword = self.lowered[self.pos]
+            handler = handlers.get(keyword)
+            if handler is None:
+                raise QuerySyntaxError(f"Unexpected '{self.tokens[self.pos]}'")
+            handler()
+        return Query(**self.clauses)
+
+    def parse_sum(self):
+        self.pos += 1
+        fields = []
+        while self.pos < len(self.tokens) and self.lowered[self.pos] not in KEYWORDS:
+            fields.append(self.tokens[self.pos])
+            self.pos += 1
+        if not fields:
+            raise QuerySyntaxError("Expected at least one field after 'sum'")
+        self.set_clause('sum', SumClause(tuple(fields)))
+
+    def parse_group(self):
+        self.pos += 1
+        self.expect('by')
+        self.set_clause('group', GroupClause(self.take("a column after 'group by'")))
+
+    def set_order(self, column=None, direction=None):
+        # 'order by col', 'order by col descending' and a separate
+        # 'order descending' all describe the same clause
+        current = self.clauses.get('order', OrderClause())
+        if (column and current.column) or (direction and current.direction):
+            raise QuerySyntaxError("Duplicate order clause")
+        self.clauses['order'] = OrderClause(column or current.column, direction or current.direction)
+
+    def parse_order(self):
+        self.pos += 1
+        if self.peek() in DIRECTIONS:
+            self.set_order(direction=self.lowered[self.pos])
+            self.pos += 1
+            return
+        self.expect('by')
+        column = self.take("a column after 'order by'")
+        direction = None
+        if self.peek() in DIRECTIONS:
+            direction = self.lowered[self.pos]
+            self.pos += 1
+        self.set_order(column, direction)
+
+    def parse_direction(self):
+        self.set_order(direction=self.lowered[self.pos])
+        self.pos += 1
+
+    def parse_filter(self):
+        self.pos += 1
+        self.expect('by')
+        column = self.take("a column after 'filter by'")
+        if self.peek() in ('=', 'in'):
+            self.pos += 1
+        # Values are comma separated, possibly with spaces around the commas
+        text = self.take(f"values for filter on '{column}'")
+        while text.endswith(',') or (self.pos < len(self.tokens) and self.tokens[self.pos].startswith(',')):
+            text += self.take(f"values for filter on '{column}'")
+        values = tuple(value.strip() for value in text.split(',') if value.strip())
+        self.set_clause('filter', FilterClause(column, values))
+
+    def parse_time(self):
+        bound = self.lowered[self.pos]
+        self.pos += 1
+        self.expect('time')
+        date_str = self.take(f"a date after '{bound} time'")
+        try:
+            epoch_time = parse_date_to_epoch(date_str)
+        except ValueError:
+            raise QuerySyntaxError(f"Invalid {bound} time '{date_str}', expected dd/mm/yyyy")
+        current = self.clauses.get('time', TimeClause())
+        if getattr(current, bound) is not None:
+            raise QuerySyntaxError(f"Duplicate {bound} time clause")
+        self.clauses['time'] = dataclasses.replace(current, **{bound: epoch_time})
+
+    def parse_chart(self):
+        self.pos += 1
+        self.set_clause('chart', ChartClause(self.take("a chart type after 'chart'").lower()))
+
+    def parse_limit(self):
+        self.pos += 1
+        count = self.take("a number after 'limit'")
+        if not count.isdigit() or int(count) == 0:
+            raise QuerySyntaxError(f"Invalid limit '{count}'")
+        self.set_clause('limit', LimitClause(int(count)))
+
+def parse_query(request):
+    return QueryParser(request).parse()
+
+def validate_query(query, chart_types=None):
+    if chart_types is not None:
+        if query.chart is None:
+            raise QuerySyntaxError("Missing chart clause")
+        if query.chart_type not in chart_types:
+            raise QuerySyntaxError(f"Chart type '{query.chart_type}' not supported")
+    if query.time and query.time.start is not None and query.time.end is not None and query.time.start > query.time.end:
+        raise QuerySyntaxError("Start time is after end time")
+    return query
+
+def query_params(query):
+    # Parameters of the upstream /data call
+    params = {
+        'start_time': query.time.start if query.time and query.time.start else '0',
+        'end_time': query.time.end if query.time and query.time.end else '99999999999999999999999999',
+        'version': '4',
+        'country_code': '0000',
+    }
+
+    if query.sum:
+        # Encode the sum fields manually to ensure + is encoded correctly
+        params['sum'] = '%20%2B%20'.join(query.sum.fields)
+    if query.group:
+        params['group_by'] = query.group.column
+    if query.order and query.order.column:
+        params['order_by'] = query.order.column
+    if query.filter and query.filter.values:
+        params['filters'] = f'["""{query.filter.column}"""]'
+        params['filter_values'] = '[' + ','.join(f'"""{value}"""' for value in query.filter.values) + ']'
+    if query.order and query.order.column and query.order.direction:
+        params['order'] = query.order.direction
+    if query.limit:
+        params['limit'] = str(query.limit.count)
+    return params
+
+def top_k_spec(query):
+    # (column, count, largest) when the request asks for the first N rows by
+    # a column, so the rows can be picked locally whatever order the upstream
+    # returns them in. A limit without a direction means the top N, only an
+    # explicit 'ascending' picks the smallest
+    if query.limit is None or query.order is None or not query.order.column:
+        return None
+    return query.order.column, query.limit.count, query.order.direction != 'ascending'
+
+def response_columns(query):
+    # {column: kind} of the rows the upstream answers a grouped sum with, the
+    # group column (its labels) and the summed 'value', in order. None when
+    # the shape is not known ahead of the fetch
+    if query.group is None or query.sum is None:
+        return None
+    return {query.group.column: 'category', 'value': 'float'}
+
+def is_time_bounded(query):
+    return query.time is not None and query.time.end is not None and query.time.end <= time.time()
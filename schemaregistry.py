@@ -0,0 +1,65 @@
+import csv
+import hashlib
+import json
+import os
+from aliasindex import AliasIndex
+
+# Alias index per dataset, built from the column names only. The columns come
+# from a <dataset>.schema.json file ({"columns": [...]}) when there is one,
+# otherwise from the CSV header line, so the data itself is never read. The
+# generated alias -> column maps are stored as JSON under ALIAS_CACHE_DIR,
+# keyed by a hash of the cache format, the column list and the alias
+# generator, and the index is built from the stored map. Plain JSON, so a
+# cache file never runs code and survives changes to AliasIndex.
+
+ALIAS_CACHE_DIR = os.environ.get('ALIAS_CACHE_DIR', '.alias_cache')
+ALIAS_CACHE_VERSION = 2
+
+loaded_indexes = {}
+
+def schema_path_for(data_path):
+    return os.path.splitext(data_path)[0] + '.schema.json'
+
+def read_columns(data_path):
+    schema_path = schema_path_for(data_path)
+    if os.path.exists(schema_path):
+        with open(schema_path) as f:
+            return json.load(f)['columns']
+    with open(data_path, newline='') as f:
+        return next(csv.reader(f))
+
+def schema_key(columns, generate_aliases):
+    digest = hashlib.sha256(json.dumps([ALIAS_CACHE_VERSION, columns]).encode('utf-8'))
+    # Different scripts generate different alias variations, and editing a
+    # generator has to invalidate what it built before
+    digest.update(generate_aliases.__qualname__.encode('utf-8'))
+    digest.update(generate_aliases.__code__.co_code)
+    digest.update(repr(generate_aliases.__code__.co_consts).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def build_alias_index(columns, generate_aliases):
+    cache_path = os.path.join(ALIAS_CACHE_DIR, f"{schema_key(columns, generate_aliases)}.json")
+    try:
+        with open(cache_path) as f:
+            return AliasIndex(json.load(f))
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    aliases = generate_aliases(columns)
+    try:
+        os.makedirs(ALIAS_CACHE_DIR, exist_ok=True)
+        # Write then rename so a concurrent reader never sees half a file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(aliases, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError) as e:
+        print(f"Could not persist aliases to {cache_path}: {str(e)}")
+    return AliasIndex(aliases)
+
+def get_alias_index(data_path, generate_aliases):
+    # Loaded on first use and then kept for the life of the process
+    key = (os.path.abspath(data_path), generate_aliases)
+    if key not in loaded_indexes:
+        loaded_indexes[key] = build_alias_index(read_columns(data_path), generate_aliases)
+    return loaded_indexes[key]
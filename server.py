@@ -1,199 +1,378 @@
 import urllib.parse
+import os
 import time
-from datetime import datetime
-import requests
-import pandas as pd
-import matplotlib.pyplot as plt
-import io
-import base64
+import multiprocessing
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import aiohttp
+from aiohttp import web
+import yarl
 import websockets
 import asyncio
 import json
+import chartrender
+from chartspecs import CHART_TYPES, ChartSpecError, validate_chart
+from chartcache import LRUCache, SingleFlight
+from requestdsl import QuerySyntaxError, parse_query, validate_query, query_params, is_time_bounded, top_k_spec, response_columns
+from metrics import Histogram, Counter, render_samples
+from outputformat import PNG, parse_output_format
 
-def parse_date_to_epoch(date_str):
-    # Convert date string in dd/mm/yyyy format to epoch timestamp
-    dt = datetime.strptime(date_str, "%d/%m/%Y")
-    epoch_time = int(time.mktime(dt.timetuple()))
-    return epoch_time
-
-def parse_request_to_curl_command(request, api_key):
-    # Initialize parameters
-    sum_fields = []
-    group_by = None
-    order_by = None
-    filters = []
-    filter_values = []
-    start_time = None
-    end_time = None
-    order = None
-    chart_type = None
-    limit = None
-    
-    # Define parts and identify components
-    parts = request.split(' ')
-    
-    # Parse sum fields
-    if 'sum' in parts:
-        index_sum = parts.index('sum') + 1
-        while index_sum < len(parts) and parts[index_sum] not in ['group', 'filter', 'start', 'order', 'chart', 'limit']:
-            sum_fields.append(parts[index_sum])
-            index_sum += 1
-        sum_fields = ' + '.join(sum_fields)  # Join with space + space
-    
-    # Parse group by
-    if 'group' in parts and 'by' in parts:
-        index_group_by = parts.index('by', parts.index('group')) + 1
-        group_by = parts[index_group_by]
-    
-    # Parse order by
-    if 'order' in parts and 'by' in parts:
-        index_order_by = parts.index('by', parts.index('order')) + 1
-        order_by = parts[index_order_by]
-        # Check for ascending or descending
-        if 'ascending' in parts or 'descending' in parts:
-            index_order = parts.index('ascending') if 'ascending' in parts else parts.index('descending')
-            order = parts[index_order]
-
-    # Parse filters
-    if 'filter' in parts and 'by' in parts:
-        index_filter_by = parts.index('by', parts.index('filter')) + 1
-        filter_col = parts[index_filter_by]
-        filter_value = parts[index_filter_by + 2].split(',')
-        filters.append(f'"""{filter_col}"""')
-        filter_values.extend([f'"""{value.strip()}"""' for value in filter_value])
-
-    # Parse start time
-    if 'start' in parts and 'time' in parts:
-        index_start_time = parts.index('time', parts.index('start')) + 1
-        start_time = parse_date_to_epoch(parts[index_start_time])
-    
-    # Parse end time
-    if 'end' in parts and 'time' in parts:
-        index_end_time = parts.index('time', parts.index('end')) + 1
-        end_time = parse_date_to_epoch(parts[index_end_time])
-    
-    # Parse chart type
-    if 'chart' in parts:
-        index_chart = parts.index('chart') + 1
-        chart_type = parts[index_chart]
-    
-    # Parse limit
-    if 'limit' in parts:
-        index_limit = parts.index('limit') + 1
-        limit = parts[index_limit]
-
-    # Construct parameters for the URL
-    base_url = "http://197.13.9.211:12054/data"
-    params = {
-        'start_time': start_time if start_time else '0',
-        'end_time': end_time if end_time else '99999999999999999999999999',
-        'version': '4',
-        'country_code': '0000',
-    }
-    
-    if sum_fields:
-        # Encode the sum fields manually to ensure + is encoded correctly
-        sum_encoded = sum_fields.replace(' + ', '%20%2B%20')
-        params['sum'] = sum_encoded
-    
-    if group_by:
-        params['group_by'] = group_by
-    if order_by:
-        params['order_by'] = order_by
-    if filters and filter_values:
-        params['filters'] = '[' + ','.join(filters) + ']'
-        params['filter_values'] = '[' + ','.join(filter_values) + ']'
-    if order:
-        params['order'] = order
-    if limit:
-        params['limit'] = limit
+# Upstream /data endpoint and where the WebSocket server listens, overridable
+# so benchmarks can point the server at a local stand-in
+UPSTREAM_URL = os.environ.get('CHART_UPSTREAM_URL', "http://197.13.9.211:12054/data")
+SERVER_HOST = os.environ.get('CHART_SERVER_HOST', "localhost")
+SERVER_PORT = int(os.environ.get('CHART_SERVER_PORT', "8765"))
+METRICS_PORT = int(os.environ.get('CHART_METRICS_PORT', str(SERVER_PORT + 1)))
 
+def build_query_url(params):
     # Construct final URL
+    base_url = UPSTREAM_URL
     query_string = urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
-    final_url = f"{base_url}?{query_string}"
-    
-    print(params)
-    # Construct curl command
-    curl_command = f"curl -X 'GET' '{final_url}' -H 'accept: application/json' -H 'x-api-key: {api_key}'"
-    
-    return curl_command, final_url, chart_type
-
-def fetch_data_from_api(request, api_key):
-    curl_command, final_url, chart_type = parse_request_to_curl_command(request, api_key)
-    response = requests.get(final_url, headers={'accept': 'application/json', 'x-api-key': api_key})
-    if response.status_code == 200:
-        return response.json(), chart_type
-    else:
-        print(f"Failed to fetch data from API. Status code: {response.status_code}")
-        print(f"Response text: {response.text}")
-        return None, None
-
-def generate_chart(data, chart_type):
-    df = pd.DataFrame(data)
-    img = io.BytesIO()
-
-    if chart_type == 'table':
-        fig, ax = plt.subplots(figsize=(12, 4))  # Set figure size as required
-        ax.axis('tight')
-        ax.axis('off')
-        table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
-        table.auto_set_font_size(False)
-        table.set_fontsize(12)
-        plt.title('Table Chart')
-    elif chart_type == 'pie':
-        plt.figure(figsize=(8, 8))
-        df.set_index(df.columns[0]).plot.pie(y=df.columns[1], autopct='%1.1f%%')
-        plt.title('Pie Chart')
-    elif chart_type == 'bar':
-        plt.figure(figsize=(10, 6))
-        df.plot(kind='bar')
-        plt.title('Bar Chart')
-    elif chart_type == 'line':
-        plt.figure(figsize=(10, 6))
-        df.plot(kind='line')
-        plt.title('Line Chart')
-    elif chart_type == 'scatter':
-        plt.figure(figsize=(10, 6))
-        if df.shape[1] > 2:
-            sns.scatterplot(data=df, x=df.columns[0], y=df.columns[1], hue=df.columns[2])
-        else:
-            sns.scatterplot(data=df, x=df.columns[0], y=df.columns[1])
-        plt.title('Scatter Plot')
-    else:
-        print("Chart type not supported")
-        return None
+    return f"{base_url}?{query_string}"
+
+# Upstream /data client settings
+UPSTREAM_MAX_CONCURRENCY = 64  # cap on simultaneous /data calls from this process
+UPSTREAM_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5)
+UPSTREAM_KEEPALIVE = 30  # seconds an idle pooled connection is kept open
+
+upstream_session = None
+upstream_semaphore = None
+
+def get_upstream_session():
+    # Created lazily so the session and semaphore bind to the running event loop
+    global upstream_session, upstream_semaphore
+    if upstream_session is None or upstream_session.closed:
+        connector = aiohttp.TCPConnector(limit=UPSTREAM_MAX_CONCURRENCY, keepalive_timeout=UPSTREAM_KEEPALIVE)
+        upstream_session = aiohttp.ClientSession(connector=connector, timeout=UPSTREAM_TIMEOUT)
+        upstream_semaphore = asyncio.Semaphore(UPSTREAM_MAX_CONCURRENCY)
+    return upstream_session
+
+async def close_upstream_session():
+    global upstream_session
+    if upstream_session is not None:
+        await upstream_session.close()
+        upstream_session = None
+
+async def fetch_query_data(params, api_key):
+    # Returns the decoded JSON and the size of the response body
+    final_url = build_query_url(params)
+    session = get_upstream_session()
+    headers = {'accept': 'application/json', 'x-api-key': api_key}
+    try:
+        async with upstream_semaphore:
+            # The query string is already encoded, don't let yarl re-quote it
+            async with session.get(yarl.URL(final_url, encoded=True), headers=headers) as response:
+                if response.status == 200:
+                    body = await response.read()
+                    return json.loads(body), len(body)
+                print(f"Failed to fetch data from API. Status code: {response.status}")
+                print(f"Response text: {await response.text()}")
+                return None, 0
+    except asyncio.TimeoutError:
+        print(f"Timed out fetching data from API: {final_url}")
+        return None, 0
+    except aiohttp.ClientError as e:
+        print(f"Failed to fetch data from API: {e}")
+        return None, 0
+
+# Result cache settings. Queries without an end time (or ending in the future)
+# keep changing upstream so they get a short TTL in their own tier, queries
+# over a closed time range can be kept for much longer.
+OPEN_QUERY_TTL = 60
+BOUNDED_QUERY_TTL = 3600
+
+open_data_cache = LRUCache('data_open', max_entries=512, max_bytes=64 * 1024 * 1024, ttl=OPEN_QUERY_TTL)
+bounded_data_cache = LRUCache('data_bounded', max_entries=2048, max_bytes=256 * 1024 * 1024, ttl=BOUNDED_QUERY_TTL)
+chart_cache = LRUCache('chart', max_entries=1024, max_bytes=128 * 1024 * 1024, ttl=BOUNDED_QUERY_TTL)
+
+# Identical requests arriving together (a shared dashboard loading) wait on a
+# single upstream fetch and a single render
+fetch_flight = SingleFlight('fetch')
+render_flight = SingleFlight('render')
+
+def query_cache_key(query, api_key):
+    # The api key is part of the key, different keys may not see the same data
+    return (api_key, query.data_key())
 
-    plt.savefig(img, format='png')
-    plt.close()
-    img.seek(0)
+def data_cache_for(query):
+    return bounded_data_cache if is_time_bounded(query) else open_data_cache
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (open_data_cache, bounded_data_cache, chart_cache, fetch_flight, render_flight)}
+
+# Chart rendering pool settings
+RENDER_WORKERS = os.cpu_count() or 1
+
+render_pool = None
+renders_in_flight = 0
+
+def get_render_pool():
+    # Spawned (not forked) workers, so they don't inherit the event loop or
+    # the upstream session; each one warms up its own Agg backend on start
+    global render_pool
+    if render_pool is None:
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                          mp_context=multiprocessing.get_context('spawn'),
+                                          initializer=chartrender.init_worker)
+    return render_pool
+
+async def warm_render_pool():
+    # Start every worker up front instead of on the first chart requests
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    await asyncio.gather(*[loop.run_in_executor(pool, chartrender.worker_pid) for _ in range(RENDER_WORKERS)])
+
+def drop_render_pool(pool):
+    # Only the pool that broke, renders failing together must not throw away
+    # the replacement another one already started
+    global render_pool
+    if render_pool is pool:
+        render_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_render_pool():
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown(cancel_futures=True)
+        render_pool = None
+
+async def generate_chart(data, chart_type, timings=None, top=None, output=PNG):
+    # Rendering is CPU bound, the loop only waits for the encoded chart
+    global renders_in_flight
+    loop = asyncio.get_running_loop()
+    renders_in_flight += 1
+    pool = get_render_pool()
+    try:
+        img, render_timings = await loop.run_in_executor(pool, chartrender.render_chart_timed, data, chart_type, top, output)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory), the pool never recovers by
+        # itself: fail the renders it took down and start a new one
+        print("Render worker died, restarting the render pool")
+        drop_render_pool(pool)
+        return None
+    finally:
+        renders_in_flight -= 1
+    if timings is not None:
+        timings.update(render_timings)
     return img
 
-async def handle_client(websocket, path):
+def record_timing(timings, stage, start):
+    # Adds the seconds elapsed since start to a stage, timings may be None
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+async def fetch_and_cache_data(params, api_key, data_key, data_cache):
+    # Fetch data from API
+    api_data, size = await fetch_query_data(params, api_key)
+    if api_data:
+        data_cache.put(data_key, api_data, size)
+    return api_data
+
+async def load_query_data(query, api_key, data_key, timings=None):
+    data_cache = data_cache_for(query)
+    api_data = data_cache.get(data_key)
+    if api_data is None:
+        start = time.perf_counter()
+        params = query_params(query)
+        api_data = await fetch_flight.do(data_key, lambda: fetch_and_cache_data(params, api_key, data_key, data_cache))
+        record_timing(timings, 'fetch', start)
+    return api_data, data_cache
+
+async def render_and_cache_chart(query, api_key, data_key, timings=None, output=PNG):
+    api_data, data_cache = await load_query_data(query, api_key, data_key, timings)
+    if not api_data:
+        return None, "Failed to fetch data from API."
+
+    start = time.perf_counter()
+    img = await generate_chart(api_data, query.chart_type, timings, top_k_spec(query), output)
+    record_timing(timings, 'render', start)
+    if not img:
+        return None, "Failed to generate chart."
+    # A chart never outlives the data it was drawn from
+    chart_cache.put((data_key, query.chart_type, output), img, len(img), ttl=data_cache.ttl)
+    return img, None
+
+def parse_chart_request(request, timings=None):
+    # Reject malformed requests, and charts the answer could not be drawn
+    # as, before anything is fetched
+    start = time.perf_counter()
+    try:
+        query = validate_query(parse_query(request), CHART_TYPES)
+        columns = response_columns(query)
+        if columns is not None:
+            try:
+                validate_chart(query.chart_type, list(columns), columns)
+            except ChartSpecError as e:
+                raise QuerySyntaxError(str(e))
+        return query
+    finally:
+        record_timing(timings, 'parse', start)
+
+async def process_request(request, api_key, timings=None, output=PNG):
+    # timings, when given, collects seconds per pipeline stage for this
+    # request, output is the outputformat.OutputFormat to answer in
+    try:
+        query = parse_chart_request(request, timings)
+    except QuerySyntaxError as e:
+        return None, f"Invalid request: {str(e)}"
+    data_key = query_cache_key(query, api_key)
+
+    img = chart_cache.get((data_key, query.chart_type, output))
+    if img:
+        return img, None
+    # Only the request that starts the render fills in fetch/render timings,
+    # requests coalesced onto it just record how long they waited
+    start = time.perf_counter()
+    flight_timings = {}
+    result = await render_flight.do((data_key, query.chart_type, output), lambda: render_and_cache_chart(query, api_key, data_key, flight_timings, output))
+    if timings is not None:
+        if flight_timings:
+            timings.update(flight_timings)
+        else:
+            record_timing(timings, 'coalesced', start)
+    return result
+
+async def send_response(websocket, send_lock, header, payload=None):
+    # A chart goes out as a small JSON header frame followed by the raw chart
+    # (PNG, SVG or JSON spec, see the header's content_type) in a binary frame; the lock keeps the two frames of a response together
+    # when several requests finish at once on the same connection
+    async with send_lock:
+        await websocket.send(json.dumps(header))
+        if payload is not None:
+            await websocket.send(payload)
+
+# Request metrics, served in Prometheus text format on METRICS_PORT
+stage_seconds = Histogram('chart_stage_seconds', 'Seconds spent in each request stage', ('stage', 'chart_type'))
+request_seconds = Histogram('chart_request_seconds', 'Seconds from receiving a request to sending its response', ('chart_type',))
+requests_total = Counter('chart_requests_total', 'Chart requests handled', ('chart_type', 'status'))
+
+CACHE_COUNTERS = ('hits', 'misses', 'evictions', 'expirations', 'started', 'coalesced')
+
+def request_chart_type(request):
+    # Label for the metrics, parsing is cheap enough to do it again here.
+    # Chart words outside the registry share one label, so junk requests
+    # cannot add series
     try:
-        message = await websocket.recv()
-        request_data = json.loads(message)
-        request = request_data['request']
-        api_key = request_data['api_key']
-
-        # Fetch data from API
-        api_data, chart_type = fetch_data_from_api(request, api_key)
-
-        if api_data:
-            img = generate_chart(api_data, chart_type)
-            if img:
-               img_base64 = base64.b64encode(img.getvalue()).decode('utf-8')
-               await websocket.send(img_base64)
-            else:
-                await websocket.send("Failed to generate chart.")
+        chart_type = parse_query(request).chart_type
+    except QuerySyntaxError:
+        return 'invalid'
+    if chart_type is None:
+        return 'none'
+    return chart_type if chart_type in CHART_TYPES else 'unsupported'
+
+def observe_request(chart_type, status, timings):
+    for stage, seconds in timings.items():
+        if stage != 'total':
+            stage_seconds.observe(seconds, stage, chart_type)
+    request_seconds.observe(timings['total'], chart_type)
+    requests_total.inc(chart_type, status)
+
+def render_metrics():
+    lines = stage_seconds.render() + request_seconds.render() + requests_total.render()
+    # Cache and single flight counters, read at scrape time
+    stats = cache_stats()
+    for stat in sorted({stat for cache in stats.values() for stat in cache}):
+        metric_type = 'counter' if stat in CACHE_COUNTERS else 'gauge'
+        samples = [([('cache', name)], cache[stat]) for name, cache in sorted(stats.items()) if stat in cache]
+        lines += render_samples(f'chart_cache_{stat}', f'Cache statistic {stat}', metric_type, samples)
+    lines += render_samples('chart_render_workers', 'Processes in the render pool', 'gauge', [([], RENDER_WORKERS)])
+    lines += render_samples('chart_renders_in_flight', 'Renders submitted to the pool and not finished', 'gauge', [([], renders_in_flight)])
+    return '\n'.join(lines) + '\n'
+
+async def metrics_handler(request):
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, SERVER_HOST, METRICS_PORT).start()
+    print(f"Metrics served on http://{SERVER_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+async def handle_request(websocket, send_lock, request_data):
+    start = time.perf_counter()
+    request_id = request_data.get('request_id') if isinstance(request_data, dict) else None
+    chart_type = 'invalid'
+    img = None
+    timings = {}
+    try:
+        chart_type = request_chart_type(request_data['request'])
+        try:
+            output = parse_output_format(request_data.get('format'))
+        except QuerySyntaxError as e:
+            output, error = None, f"Invalid request: {str(e)}"
+        if output is not None:
+            img, error = await process_request(request_data['request'], request_data['api_key'], timings, output)
+        if img:
+            header = {'request_id': request_id, 'status': 'ok', 'content_type': output.content_type, 'size': len(img)}
         else:
-            await websocket.send("Failed to fetch data from API.")
+            header = {'request_id': request_id, 'status': 'error', 'message': error}
     except Exception as e:
-        await websocket.send(f"Error: {str(e)}")
+        header = {'request_id': request_id, 'status': 'error', 'message': f"Error: {str(e)}"}
+    # Per-stage server side timings in milliseconds, for clients and benchmarks
+    header['timings'] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
 
-# Start WebSocket server
-start_server = websockets.serve(handle_client, "localhost", 8765)
+    send_start = time.perf_counter()
+    try:
+        await send_response(websocket, send_lock, header, img)
+    except websockets.ConnectionClosed:
+        pass
+    record_timing(timings, 'send', send_start)
+    record_timing(timings, 'total', start)
+    observe_request(chart_type, header['status'], timings)
+
+# Requests one session can have in progress; past that the session's next
+# message is not read until one finishes, which pushes back on the client
+MAX_INFLIGHT_PER_CONNECTION = 32
+
+async def handle_client(websocket, path=None):
+    # One session serves many requests; each runs as its own task and its
+    # response goes out as soon as it's done, tagged with the request_id
+    send_lock = asyncio.Lock()
+    inflight = asyncio.Semaphore(MAX_INFLIGHT_PER_CONNECTION)
+    tasks = set()
+    try:
+        async for message in websocket:
+            try:
+                request_data = json.loads(message)
+            except ValueError as e:
+                await send_response(websocket, send_lock, {'request_id': None, 'status': 'error', 'message': f"Error: {str(e)}"})
+                continue
+            await inflight.acquire()
+            task = asyncio.create_task(handle_request(websocket, send_lock, request_data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda task: inflight.release())
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
 
-print("WebSocket server started on ws://localhost:8765")
+async def main():
+    # SIGTERM cancels main like Ctrl-C does, so the render workers are shut
+    # down instead of outliving the server
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # no signal handlers in the Windows event loop
+    await warm_render_pool()
+    metrics_runner = await start_metrics_server()
+    # Start WebSocket server
+    async with websockets.serve(handle_client, SERVER_HOST, SERVER_PORT):
+        print(f"WebSocket server started on ws://{SERVER_HOST}:{SERVER_PORT}")
+        try:
+            await asyncio.Future()
+        finally:
+            await metrics_runner.cleanup()
+            await close_upstream_session()
+            shutdown_render_pool()
 
-asyncio.get_event_loop().run_until_complete(start_server)
-asyncio.get_event_loop().run_forever()
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,139 @@
+import csv
+import io
+import os
+import numpy as np
+import pandas as pd
+from aggcubes import AggregateCubes
+from chartspecs import ChartSpecError, validate_chart
+from topk import top_k
+
+# Streaming mode for the viewership events. EventTail follows an append-only
+# CSV (header line first) or JSONL file and hands out the complete lines
+# appended since the last poll, at most CHUNK_BYTES at a time, as typed
+# frames. LiveViewership folds each chunk into running aggregate cubes (row
+# count, count/sum/sum of squares/min/max of every measure per value of each
+# dimension and of each pair of dimensions, see aggcubes), so the events are
+# read exactly once and memory does not grow with their number. Parsed chart
+# requests are answered from the cubes: grouped by one of the dimensions,
+# filtered on at most one more.
+
+STREAM_DIMENSIONS = ('Genre', 'Country', 'Device_Type')
+STREAM_MEASURES = ('Duration_Watched', 'Age', 'Ratings', 'Interaction_Events')
+CHUNK_BYTES = 8 * 1024 * 1024
+# Charts drawn from values per group, the others need the individual events
+LIVE_CHART_TYPES = ('table', 'bar', 'pie', 'line', 'area')
+
+class EventTail:
+    def __init__(self, path, dimensions, measures, chunk_bytes=CHUNK_BYTES):
+        self.path = path
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.chunk_bytes = chunk_bytes
+        self.jsonl = path.endswith('.jsonl')
+        self.offset = 0
+        self.header = None
+
+    def read_lines(self, f):
+        # Up to chunk_bytes of complete lines (or one longer line), b'' when
+        # only a partial line has been written so far
+        data = f.read(self.chunk_bytes)
+        end = data.rfind(b'\n')
+        if end < 0:
+            if len(data) < self.chunk_bytes:
+                return b''
+            data += f.readline()
+            end = data.rfind(b'\n')
+            if end < 0:
+                return b''
+        return data[:end + 1]
+
+    def rewind_if_truncated(self):
+        # True if the file got shorter (replaced or truncated) since the last
+        # read, it is then read again from the start
+        if self.offset <= os.path.getsize(self.path):
+            return False
+        print(f"{self.path} got shorter, reading it again from the start")
+        self.offset = 0
+        self.header = None
+        return True
+
+    def chunks(self):
+        # Frames of the events appended since the last call
+        with open(self.path, 'rb') as f:
+            while True:
+                f.seek(self.offset)
+                data = self.read_lines(f)
+                if not data:
+                    return
+                self.offset += len(data)
+                if not self.jsonl and self.header is None:
+                    first, _, data = data.partition(b'\n')
+                    self.header = next(csv.reader([first.decode('utf-8').strip()]))
+                    if not data:
+                        continue
+                yield self.parse(data)
+
+    def parse(self, data):
+        columns = self.dimensions + self.measures
+        if self.jsonl:
+            df = pd.read_json(io.BytesIO(data), lines=True, dtype=False).reindex(columns=columns)
+        else:
+            df = pd.read_csv(io.BytesIO(data), names=self.header, header=None,
+                             usecols=[column for column in columns if column in self.header])
+            df = df.reindex(columns=columns)
+        df = df.astype({dimension: 'category' for dimension in self.dimensions})
+        return df.assign(**{measure: pd.to_numeric(df[measure], errors='coerce').astype(np.float64) for measure in self.measures})
+
+class LiveViewership:
+    def __init__(self, path, dimensions=STREAM_DIMENSIONS, measures=STREAM_MEASURES, chunk_bytes=CHUNK_BYTES):
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.tail = EventTail(path, self.dimensions, self.measures, chunk_bytes)
+        self.cubes = None
+        self.rows = 0
+
+    def poll(self):
+        # Folds the events appended since the last poll into the aggregates,
+        # returns how many there were
+        if self.tail.rewind_if_truncated():
+            self.cubes = None
+            self.rows = 0
+        added = 0
+        for chunk in self.tail.chunks():
+            if self.cubes is None:
+                self.cubes = AggregateCubes(chunk, self.dimensions, self.measures)
+            else:
+                self.cubes.add(chunk)
+            self.rows += len(chunk)
+            added += len(chunk)
+        return added
+
+    def chart_frame(self, chart_type, columns, conditions=None, group_by=None, order_by=None, top_x=None):
+        # (frame, columns) to draw chart_type from, one row per group of the
+        # request's dimension. Raises ChartSpecError for requests the live
+        # aggregates cannot answer
+        if chart_type not in LIVE_CHART_TYPES:
+            raise ChartSpecError(f"A {chart_type} chart needs the individual events, live charts are {', '.join(LIVE_CHART_TYPES)}")
+        dimension = group_by if group_by in self.dimensions else next((column for column in columns if column in self.dimensions), None)
+        if dimension is None:
+            raise ChartSpecError(f"Live charts are grouped by one of {', '.join(self.dimensions)}")
+        if self.cubes is None:
+            raise ChartSpecError("No events received yet")
+        measures = [column for column in columns if column in self.measures]
+        if measures:
+            # Shares of a total for pies, averages per group otherwise
+            frame = self.cubes.aggregate([dimension], measures, 'sum' if chart_type == 'pie' else 'mean', conditions)
+        else:
+            frame = self.cubes.aggregate([dimension], [], 'size', conditions)
+            frame = None if frame is None else frame.rename('count').to_frame()
+            measures = ['count']
+        if frame is None:
+            raise ChartSpecError(f"Live charts can only filter on {', '.join(self.dimensions)}")
+        frame = frame.reset_index()
+        chart_columns = [dimension] + measures
+        validate_chart(chart_type, chart_columns)
+        if order_by in frame.columns:
+            frame = frame.sort_values(order_by)
+        if top_x and top_x[1] in frame.columns:
+            frame = top_k(frame, top_x[1], top_x[0])
+        return frame, chart_columns
@@ -1,19 +1,23 @@
-import spacy
-import pandas as pd
 from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
 import re
+from functools import lru_cache
+from schemaregistry import get_alias_index
+from nlpfallback import resolve_chart_types
+from datasetloader import load_dataset, schema_for
+from filtercompiler import apply_filter
+from chartspecs import CHART_SPECS, ChartSpecError, validate_chart, render_chart
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")
+DATA_PATH = 'streaming_viewership_data.csv'
 
-# Read data from CSV file
-df = pd.read_csv('streaming_viewership_data.csv')
+@lru_cache(maxsize=None)
+def load_data():
+    # Read data from CSV file, only once a request actually needs the rows
+    return load_dataset(DATA_PATH)
 
 # Function to generate column aliases
-def generate_column_aliases(df):
+def generate_column_aliases(columns):
     column_aliases = {}
-    for col in df.columns:
+    for col in columns:
         col_variations = [col, col.lower(), col.replace("_", " "), col.replace("_", "").lower()]
         col_variations += [re.sub(r'\W+', '', col).lower()]
         col_variations = list(set(col_variations))
@@ -21,24 +25,29 @@ def generate_column_aliases(df):
             column_aliases[variation] = col
     return column_aliases
 
-# Generate dynamic column aliases
-column_aliases = generate_column_aliases(df)
+# Dynamic column aliases, built from the CSV header only and cached on disk
+def column_alias_index():
+    return get_alias_index(DATA_PATH, generate_column_aliases)
 
-def parse_request(request, df, column_aliases):
-    doc = nlp(request)
+CHART_TYPES = ['pie', 'bar', 'histogram', 'line', 'area', 'scatter', 'box', 'heatmap', 'violin', 'bubble']
+
+def parse_requests(requests, alias_index):
+    # Chart types are resolved for the whole batch at once, so any requests
+    # that need the spaCy fallback go through one nlp.pipe call
+    chart_types = resolve_chart_types(requests, CHART_TYPES)
+    return [parse_request(request, alias_index, chart_type) for request, chart_type in zip(requests, chart_types)]
+
+def parse_request(request, alias_index, chart_type=None):
     entities = {'chart_type': None, 'columns': [], 'conditions': []}
 
-    chart_types = ['pie', 'bar', 'histogram', 'line', 'area', 'scatter', 'box', 'heatmap', 'violin', 'bubble']
-    
-    for token in doc:
-        if token.text.lower() in chart_types:
-            entities['chart_type'] = token.text.lower()
+    if chart_type is None:
+        chart_type = resolve_chart_types([request], CHART_TYPES)[0]
+    entities['chart_type'] = chart_type
 
     request_lower = request.lower()
+    words = re.findall(r'\w+', request_lower)
 
-    for alias, actual_col in column_aliases.items():
-        if alias in request_lower and actual_col not in entities['columns']:
-            entities['columns'].append(actual_col)
+    entities['columns'] = alias_index.columns_in(request_lower)
 
     condition_patterns = [
         (r"(greater|more|older|above)\s*than\s*(\d+)", "greater"),
@@ -53,8 +62,8 @@ def parse_request(request, df, column_aliases):
         match = re.search(pattern, request_lower)
         if match:
             value = int(match.group(2))
-            for token in doc:
-                if fuzz.ratio(token.text.lower(), "age") > 80:
+            for word in words:
+                if fuzz.ratio(word, "age") > 80:
                     entities['conditions'].append({'column': 'Age', 'operator': operator, 'value': value})
                     break
 
@@ -78,80 +87,37 @@ def extract_details(structured_query):
         return chart_type, columns, None, None, None
 
 def filter_data(df, filter_col, condition, value):
-    if filter_col is not None and value is not None:
-        if condition in ['greater', 'more', 'older', 'above']:
-            return df[df[filter_col] > value]
-        elif condition in ['less', 'below', 'younger']:
-            return df[df[filter_col] < value]
-        elif condition in ['equal', 'equals']:
-            return df[df[filter_col] == value]
-    return df
+    return apply_filter(df, [{'column': filter_col, 'operator': condition, 'value': value}])
 
 import matplotlib.pyplot as plt
-import seaborn as sns
 
 def generate_chart(df, chart_type, columns):
-    plt.figure(figsize=(10, 6))
-    if chart_type == 'line':
-        plt.plot(df[columns[0]], df[columns[1]], marker='o', linestyle='-')
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()}')
-    elif chart_type == 'bar':
-        sns.barplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} by {columns[0].capitalize()}')
-    elif chart_type == 'histogram':
-        plt.hist(df[columns[0]], bins=10, alpha=0.5, color='blue')
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel('Frequency')
-        plt.title(f'{columns[0].capitalize()} Histogram')
-    elif chart_type == 'pie':
-        data = df[columns[0]].value_counts()
-        plt.pie(data, labels=data.index, autopct='%1.1f%%')
-        plt.title(f'{columns[0].capitalize()} Distribution')
-    elif chart_type == 'scatter':
-        plt.scatter(df[columns[0]], df[columns[1]])
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()}')
-    elif chart_type == 'box':
-        sns.boxplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} by {columns[0].capitalize()}')
-    elif chart_type == 'heatmap':
-        sns.heatmap(df.pivot_table(index=columns[0], columns=columns[1], aggfunc='size'))
-        plt.xlabel(columns[1].capitalize())
-        plt.ylabel(columns[0].capitalize())
-        plt.title(f'{columns[0].capitalize()} vs {columns[1].capitalize()} Heatmap')
-    elif chart_type == 'violin':
-        sns.violinplot(x=columns[0], y=columns[1], data=df)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} Distribution by {columns[0].capitalize()}')
-    elif chart_type == 'area':
-        plt.fill_between(df[columns[0]], df[columns[1]], color="skyblue", alpha=0.4)
-        plt.plot(df[columns[0]], df[columns[1]], color="Slateblue", alpha=0.6)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()} Area Chart')
-    elif chart_type == 'bubble':
-        plt.scatter(df[columns[0]], df[columns[1]], s=df[columns[2]], alpha=0.5)
-        plt.xlabel(columns[0].capitalize())
-        plt.ylabel(columns[1].capitalize())
-        plt.title(f'{columns[1].capitalize()} vs {columns[0].capitalize()} (Bubble Chart)')
-    else:
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
         print(f"Chart type {chart_type} is not supported.")
+        return
+    fig = plt.figure(figsize=spec.figsize)
+    try:
+        render_chart(fig, chart_type, df, columns)
+    except ChartSpecError as e:
+        print(f"Cannot draw this chart: {e}")
+        plt.close(fig)
+        return
     plt.show()
 
-# Example request
-user_request = "I want to create a bar chart that studies the relationship between Gender and country where the  age above 50"
-structured_query = parse_request(user_request, df, column_aliases)
-print(structured_query)
-
-# Process the structured query
-chart_type, columns, filter_col, condition, value = extract_details(structured_query)
-filtered_df = filter_data(df, filter_col, condition, value)
-#generate_chart(filtered_df, chart_type, columns)
+if __name__ == '__main__':
+    # Example request
+    user_request = "I want to create a bar chart that studies the relationship between Gender and country where the  age above 50"
+    structured_query = parse_request(user_request, column_alias_index())
+    print(structured_query)
+
+    # Process the structured query
+    chart_type, columns, filter_col, condition, value = extract_details(structured_query)
+    try:
+        # Nothing is loaded for a chart the columns cannot give
+        validate_chart(chart_type, columns, schema_for(DATA_PATH))
+    except ChartSpecError as e:
+        print(f"Cannot draw this chart: {e}")
+    else:
+        filtered_df = filter_data(load_data(), filter_col, condition, value)
+        #generate_chart(filtered_df, chart_type, columns)
@@ -1,19 +1,26 @@
-import spacy
-import pandas as pd
 import re
+from functools import lru_cache
+from schemaregistry import get_alias_index
+from nlpfallback import resolve_chart_type
+from datasetloader import load_dataset, project_columns, request_columns, schema_for
+from filtercompiler import apply_filter, fold_text_columns
+from chartspecs import CHART_SPECS, ChartSpecError, validate_chart, render_chart
 import matplotlib.pyplot as plt
-import seaborn as sns
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")
+# Data file (replace with your data file)
+DATA_PATH = 'converted.csv'
 
-# Read data from CSV file (replace with your data file)
-df = pd.read_csv('converted.csv')
+@lru_cache(maxsize=None)
+def load_data():
+    # Read the data file once, with the case-folded text columns the equality
+    # filters use, so those are built once; requests filter this frame and
+    # then keep only the columns they refer to
+    return fold_text_columns(load_dataset(DATA_PATH))
 
 # Generate dynamic column aliases
-def generate_column_aliases(df):
+def generate_column_aliases(columns):
     column_aliases = {}
-    for col in df.columns:
+    for col in columns:
         col_variations = [col, col.lower(), col.replace("_", " "), col.replace("_", "").lower()]
         col_variations += [re.sub(r'\W+', '', col).lower()]
         col_variations = list(set(col_variations))
@@ -21,23 +28,21 @@ def generate_column_aliases(df):
             column_aliases[variation] = col
     return column_aliases
 
-column_aliases = generate_column_aliases(df)
+def column_alias_index():
+    # Built from the CSV header only and cached on disk per schema
+    return get_alias_index(DATA_PATH, generate_column_aliases)
 
-def parse_user_request(request, df, column_aliases):
+def parse_user_request(request, alias_index):
     entities = {'chart_type': None, 'columns': [], 'conditions': [], 'group_by': None, 'order_by': None}
     request_lower = request.lower()
 
     # Extract chart type
     chart_types = ['pie', 'bar', 'histogram', 'line', 'area', 'scatter', 'box', 'heatmap', 'violin', 'bubble']
-    chart_type_pattern = r'\b(' + '|'.join(chart_types) + r')\b'
-    chart_type_match = re.search(chart_type_pattern, request_lower)
-    if chart_type_match:
-        entities['chart_type'] = chart_type_match.group(1)
+    # Regex first, spaCy is only loaded if that finds nothing
+    entities['chart_type'] = resolve_chart_type(request_lower, chart_types)
 
     # Extract columns
-    for alias, actual_col in column_aliases.items():
-        if alias in request_lower and actual_col not in entities['columns']:
-            entities['columns'].append(actual_col)
+    entities['columns'] = alias_index.columns_in(request_lower)
 
     # Extract conditions using regex
     condition_extraction_pattern = r"(\w+)\s*(=|>|<|>=|<=|equals|greater than|less than|above|below|more than|older than|younger than)\s*'*(\w+\.?\w*)'*"
@@ -47,11 +52,7 @@ def parse_user_request(request, df, column_aliases):
         operator_text = match[1].strip().lower()
         value = match[2].strip()
 
-        condition_col = None
-        for alias, actual_col in column_aliases.items():
-            if alias == condition_col_text:
-                condition_col = actual_col
-                break
+        condition_col = alias_index.lookup(condition_col_text)
 
         if condition_col:
             if operator_text in ['=', 'equals', 'equal']:
@@ -71,66 +72,44 @@ def parse_user_request(request, df, column_aliases):
     group_by_match = re.search(group_by_pattern, request_lower)
     if group_by_match:
         group_by_col = group_by_match.group(1).strip().lower()
-        for alias, actual_col in column_aliases.items():
-            if alias == group_by_col:
-                entities['group_by'] = actual_col
-                break
+        entities['group_by'] = alias_index.lookup(group_by_col)
 
     # Extract order by
     order_by_pattern = r'order\s+by\s+(\w+)'
     order_by_match = re.search(order_by_pattern, request_lower)
     if order_by_match:
         order_by_col = order_by_match.group(1).strip().lower()
-        for alias, actual_col in column_aliases.items():
-            if alias == order_by_col:
-                entities['order_by'] = actual_col
-                break
+        entities['order_by'] = alias_index.lookup(order_by_col)
 
     return entities
 
 def filter_data(df, conditions):
-    filtered_df = df.copy()
-    if conditions:
-        for condition in conditions:
-            filter_col = condition['column']
-            operator = condition['operator']
-            value = condition['value']
-            if df[filter_col].dtype == 'O':
-                value = str(value)
-            else:
-                try:
-                    value = float(value)
-                except ValueError:
-                    print(f"Unable to convert value '{value}' to float for column '{filter_col}'. Skipping filter.")
-                    continue
-            if operator == '=':
-                filtered_df = filtered_df[filtered_df[filter_col].str.lower() == value]
-            elif operator == '>':
-                filtered_df = filtered_df[filtered_df[filter_col] > value]
-            elif operator == '<':
-                filtered_df = filtered_df[filtered_df[filter_col] < value]
-            elif operator == '>=':
-                filtered_df = filtered_df[filtered_df[filter_col] >= value]
-            elif operator == '<=':
-                filtered_df = filtered_df[filtered_df[filter_col] <= value]
-    return filtered_df
+    # Values are lowercased by the parser, so text columns compare lowercased
+    return apply_filter(df, conditions, fold_case=True)
+
+def chart_columns(chart_type, columns, group_by=None):
+    # The columns the chart is drawn from: a pie with a group by counts the
+    # rows per group
+    if chart_type == 'pie' and group_by:
+        return [group_by]
+    return list(columns)
 
 def generate_chart(df, chart_type, columns, group_by=None, order_by=None):
-    plt.figure(figsize=(10, 6))
-    
-    if chart_type == 'pie':
-        if len(columns) == 1 and group_by:  # Ensure we have one column for the pie and a valid group_by column
-            if group_by in df.columns and columns[0] in df.columns:
-                pie_data = df.groupby(group_by)[columns[0]].count()
-                plt.pie(pie_data, labels=pie_data.index, autopct='%1.1f%%', startangle=140)
-                plt.title(f'Pie Chart of {columns[0].capitalize()} by {group_by.capitalize()}')
-            else:
-                print(f"Group by column '{group_by}' or pie chart column '{columns[0]}' not found in DataFrame.")
-        else:
-            print("Invalid columns provided for pie chart.")
-    else:
+    spec = CHART_SPECS.get(chart_type)
+    if spec is None:
         print(f"Chart type '{chart_type}' is not supported for this request.")
-    
+        return
+    if order_by and order_by in df.columns:
+        df = df.sort_values(by=order_by)
+
+    fig = plt.figure(figsize=spec.figsize)
+    try:
+        render_chart(fig, chart_type, df, chart_columns(chart_type, columns, group_by), fold_case=True)
+    except ChartSpecError as e:
+        print(f"Cannot draw this chart: {e}")
+        plt.close(fig)
+        return
+
     plt.tight_layout()
     plt.show()
 
@@ -139,7 +118,7 @@ def main():
         user_input = input("Enter your request (or 'exit' to quit): ").strip().lower()
         if user_input == 'exit':
             break
-        parsed_request = parse_user_request(user_input, df, column_aliases)
+        parsed_request = parse_user_request(user_input, column_alias_index())
         print("\nParsed Request:")
         print(parsed_request)
         chart_type = parsed_request['chart_type']
@@ -148,7 +127,15 @@ def main():
         group_by = parsed_request['group_by']
         order_by = parsed_request['order_by']
 
-        filtered_df = filter_data(df, conditions)
+        try:
+            # Nothing is loaded for a chart the columns cannot give
+            validate_chart(chart_type, chart_columns(chart_type, columns, group_by), schema_for(DATA_PATH))
+        except ChartSpecError as e:
+            print(f"Cannot draw this chart: {e}")
+            continue
+
+        # Filtered with the dataset's indexes, then cut to the request's columns
+        filtered_df = project_columns(filter_data(load_data(), conditions), request_columns(parsed_request))
 
         if filtered_df.empty:
             print("\nNo data available after filtering. Skipping chart generation.")
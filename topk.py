@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# Top-K rows by a column without sorting the whole frame. The k-th value is
+# found with a partial selection (np.partition, linear time), the rows beyond
+# it are picked with one comparison pass and only those k rows are sorted.
+# Ties at the cut keep the earliest rows, NaNs are never selected, like
+# DataFrame.nlargest(keep='first'). top_k_per_group does the same within each
+# group of a group by.
+
+def select_positions(values, k, largest=True):
+    # Positions into values of its k largest (or smallest) entries, ordered
+    # by value and then by position
+    positions = np.arange(len(values))
+    if values.dtype.kind == 'f':
+        valid = ~np.isnan(values)
+        if not valid.all():
+            positions = positions[valid]
+            values = values[valid]
+    if k <= 0 or len(values) == 0:
+        return positions[:0]
+    if k < len(values):
+        if largest:
+            kth = np.partition(values, len(values) - k)[len(values) - k]
+            beyond = np.flatnonzero(values > kth)
+        else:
+            kth = np.partition(values, k - 1)[k - 1]
+            beyond = np.flatnonzero(values < kth)
+        ties = np.flatnonzero(values == kth)[:k - len(beyond)]
+        chosen = np.sort(np.concatenate([beyond, ties]))
+    else:
+        chosen = np.arange(len(values))
+    keys = values[chosen].astype(np.float64)
+    order = np.argsort(-keys if largest else keys, kind='stable')
+    return positions[chosen[order]]
+
+def sortable_values(series):
+    # The numpy array to select on, None when the column is not numeric
+    if pd.api.types.is_bool_dtype(series.dtype) or not pd.api.types.is_numeric_dtype(series.dtype):
+        return None
+    return series.to_numpy(dtype=np.float64, na_value=np.nan) if series.hasnans else series.to_numpy()
+
+def top_k(df, column, k, largest=True):
+    # df.sort_values(column, ascending=not largest).head(k) without the sort
+    values = sortable_values(df[column])
+    if values is None:
+        return df[df[column].notna()].sort_values(column, ascending=not largest, kind='stable').head(k)
+    return df.iloc[select_positions(values, k, largest)]
+
+def top_k_per_group(df, group_by, column, k, largest=True):
+    # The top k rows of every group, groups in group by order
+    values = sortable_values(df[column])
+    if values is None:
+        ordered = df[df[column].notna()].sort_values(column, ascending=not largest, kind='stable')
+        return ordered.groupby(group_by, observed=True, sort=True).head(k)
+    selected = [positions[select_positions(values[positions], k, largest)]
+                for positions in df.groupby(group_by, observed=True, sort=True).indices.values()]
+    if not selected:
+        return df.iloc[:0]
+    return df.iloc[np.concatenate(selected)]